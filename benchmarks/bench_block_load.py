@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+# Measures CashVerifier.verify_block with and without the block capture (see
+# verifier.py): "captured" is the verifier as it ships, which keeps the block
+# the core verifier parsed, and "reloaded" is the same verifier loading every
+# block a second time for the block processors, as it did before. Each run
+# verifies the whole chain from scratch, without checkpoints, and also counts
+# the blocks that had to be loaded again. Needs gpg and pyomcore, like
+# bench_pyomcash.py:
+#
+# ./bench_block_load.py --pyomcore-url ../../pyomcore --trades 100 --chain-length 10000
+
+import argparse
+import json
+import os
+import pathlib
+import statistics
+import tempfile
+import time
+from pyomcore.utils import gnupg_dirname, init_local_gpg
+from pyomcore.verifier import Verifier, check_blockchain_dir
+from synthetic_chain import generate_chains
+from pyomcash.verifier import CashVerifier
+
+
+class CountingCashVerifier(CashVerifier):
+    def read_block(self, idx):
+        self.reloads += 1
+        return super().read_block(idx)
+
+
+class ReloadingCashVerifier(CountingCashVerifier):
+    def verify_core(self, idx):
+        Verifier.verify_block(self, idx)
+        return None
+
+
+def run(cls, rootdir, repeat):
+    numblocks = check_blockchain_dir(rootdir)
+    gpg_ctx = init_local_gpg(rootdir.joinpath(gnupg_dirname))
+    seconds = []
+    for _ in range(repeat):
+        v = cls(rootdir, gpg_ctx)
+        v.reloads = 0
+        start = time.perf_counter()
+        for idx in range(numblocks):
+            v.verify_block(idx)
+        seconds.append(time.perf_counter() - start)
+    return {
+        'seconds_per_block': statistics.median(seconds) / numblocks,
+        'blocks_reloaded': v.reloads
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pyomcore-url', required=True,
+                        help='git URL or local path of pyomcore')
+    parser.add_argument('--pyomcash-url',
+                        default=pathlib.Path(__file__).resolve().parent.parent.as_posix(),
+                        help='git URL or local path of pyomcash (default: this repo)')
+    parser.add_argument('--trades', type=int, default=100)
+    parser.add_argument('--chain-length', type=int, default=1000,
+                        help='pad the chains with empty blocks up to this length')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = pathlib.Path(tmpdir).resolve()
+        os.environ['PYOMCASH_CACHE_DIR'] = workdir.joinpath('cache').as_posix()
+        users, _ = generate_chains(workdir, args.pyomcore_url, args.pyomcash_url,
+                                   num_trades=args.trades, chain_length=args.chain_length)
+        rootdir = users[0].rootdir
+        # Warm the page cache so that both runs measure the same thing.
+        run(CountingCashVerifier, rootdir, 1)
+        results = {
+            'numblocks': check_blockchain_dir(rootdir),
+            'captured': run(CountingCashVerifier, rootdir, args.repeat),
+            'reloaded': run(ReloadingCashVerifier, rootdir, args.repeat)
+        }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        pathlib.Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+# Measures the peak RSS of a full verify_chain as the chain grows, with and
+# without streaming mode. The chain is extended in steps of --trades trades,
+# and after each step the verifier is run from scratch in a fresh process, so
+# that the peaks don't include anything from the earlier runs. Needs gpg and
+# pyomcore, like bench_pyomcash.py:
+#
+# ./bench_memory.py --pyomcore-url ../../pyomcore --trades 100 --steps 4 --output memory.json
+
+import argparse
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+from pyomcore.utils import most_recent_block_idx
+from pyomcore.confirm_transactions import confirm_transactions
+from synthetic_chain import generate_chains, make_trade_matrix
+from pyomcash.utils import create_trade
+
+
+def add_trades(users, num_trades, participants_per_trade, currencies_per_trade):
+    participants = users[:participants_per_trade]
+    rootdirs = [user.rootdir for user in participants]
+    for _ in range(num_trades):
+        protoblocks = create_trade(
+            timedelta(days=1), rootdirs, make_trade_matrix(participants, currencies_per_trade))
+        for user, protoblock in zip(participants, protoblocks):
+            user.append_block(protoblock)
+        for this_user in participants:
+            for that_user in participants:
+                confirm_transactions(this_user.gpg_ctx(), this_user.rootdir,
+                                     that_user.rootdir, confirm_only=False)
+
+# Runs in the child process: verify the whole chain and report the peak RSS.
+
+
+def child(rootdir, streaming, max_memory):
+    from pyomcash.stats import peak_rss_bytes
+    from pyomcash.verifier import verify_chain
+    verify_chain(pathlib.Path(rootdir), checkpoint=False, streaming=streaming,
+                 max_memory=None if max_memory is None else max_memory * 1024 * 1024)
+    print(peak_rss_bytes())
+
+
+def peak_rss(rootdir, streaming, max_memory):
+    args = [sys.executable, __file__, '--child', rootdir.as_posix()]
+    if streaming:
+        args.append('--streaming')
+    if max_memory is not None:
+        args += ['--max-memory', str(max_memory)]
+    result = subprocess.run(args, capture_output=True, check=True)
+    return int(result.stdout.decode().split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pyomcore-url',
+                        help='git URL or local path of pyomcore')
+    parser.add_argument('--pyomcash-url',
+                        default=pathlib.Path(__file__).resolve().parent.parent.as_posix(),
+                        help='git URL or local path of pyomcash (default: this repo)')
+    parser.add_argument('--participants', type=int, default=4,
+                        help='participants per trade')
+    parser.add_argument('--currencies', type=int, default=4,
+                        help='currencies per trade')
+    parser.add_argument('--trades', type=int, default=100,
+                        help='trades added in each step')
+    parser.add_argument('--steps', type=int, default=4)
+    parser.add_argument('--max-memory', type=int, metavar='MB',
+                        help='memory budget for the streaming runs, in megabytes')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--streaming', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child is not None:
+        child(args.child, args.streaming, args.max_memory)
+        return
+    if args.pyomcore_url is None:
+        parser.error('--pyomcore-url is required')
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = pathlib.Path(tmpdir).resolve()
+        os.environ['PYOMCASH_CACHE_DIR'] = workdir.joinpath(
+            'cache').as_posix()
+        users, _ = generate_chains(
+            workdir, args.pyomcore_url, args.pyomcash_url,
+            num_users=args.participants, num_trades=0,
+            participants_per_trade=args.participants,
+            currencies_per_trade=args.currencies)
+        rootdir = users[0].rootdir
+        for step in range(1, args.steps + 1):
+            add_trades(users, args.trades, args.participants, args.currencies)
+            results.append({
+                'trades': step * args.trades,
+                'numblocks': most_recent_block_idx(rootdir) + 1,
+                'peak_rss_bytes': peak_rss(rootdir, False, None),
+                'peak_rss_bytes_streaming': peak_rss(rootdir, True, args.max_memory)
+            })
+            print(json.dumps(results[-1]), file=sys.stderr)
+    output = json.dumps({
+        'parameters': {
+            'participants_per_trade': args.participants,
+            'currencies_per_trade': args.currencies,
+            'max_memory_mb': args.max_memory
+        },
+        'steps': results
+    }, indent=2)
+    if args.output:
+        pathlib.Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
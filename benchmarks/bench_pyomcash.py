@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+# Benchmarks verify_chain, create_trade and update_balance_sheet on synthetic
+# chains, and writes the results as JSON, so that they can be compared between
+# releases. Needs gpg and pyomcore, but no network access if the contract
+# repos are local:
+#
+# ./bench_pyomcash.py --pyomcore-url ../../pyomcore --trades 100 --output results.json
+
+import argparse
+import json
+import os
+import pathlib
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pyomcore.utils import most_recent_block_idx
+from synthetic_chain import generate_chains
+import pyomcash
+from pyomcash.ledger import Ledger
+from pyomcash.verifier import verify_chain
+
+
+def summarize(seconds):
+    return {
+        'count': len(seconds),
+        'total': sum(seconds),
+        'mean': statistics.mean(seconds) if seconds else None,
+        'min': min(seconds) if seconds else None,
+        'max': max(seconds) if seconds else None
+    }
+
+
+def timed(f, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        seconds.append(time.perf_counter() - start)
+    return result, seconds
+
+# Replay the confirm and annul actions of every pyomcash transaction in the
+# chain through update_balance_sheet, on an empty ledger. Confirm and annul
+# only receive, so this can't fail the balance check.
+
+
+def bench_update_balance_sheet(v, repeat):
+    work = []
+    for status in v.transactions.values():
+        transaction = status.transaction
+        fprs = list(map(lambda p: p['gpg'], transaction['participants']))
+        for contract in v.pyomcash_contracts(transaction):
+            work.append((fprs, contract['trade_matrix']))
+    seconds = []
+    for _ in range(repeat):
+        v.ledger = Ledger()
+        start = time.perf_counter()
+        for fprs, trade_matrix in work:
+            v.update_balance_sheet('confirm_transaction', fprs, trade_matrix)
+            v.update_balance_sheet('annul_transaction', fprs, trade_matrix)
+        seconds.append(time.perf_counter() - start)
+    return len(work), seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pyomcore-url', required=True,
+                        help='git URL or local path of pyomcore')
+    parser.add_argument('--pyomcash-url',
+                        default=pathlib.Path(__file__).resolve().parent.parent.as_posix(),
+                        help='git URL or local path of pyomcash (default: this repo)')
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--trades', type=int, default=10)
+    parser.add_argument('--participants', type=int, default=2,
+                        help='participants per trade')
+    parser.add_argument('--currencies', type=int, default=2,
+                        help='currencies per trade')
+    parser.add_argument('--chain-length', type=int, default=0,
+                        help='pad the chains with empty blocks to this length')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workdir',
+                        help='where to create the chains (default: a temporary directory)')
+    parser.add_argument('--output', help='write the results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = pathlib.Path(args.workdir or tmpdir).resolve()
+        os.environ['PYOMCASH_CACHE_DIR'] = workdir.joinpath(
+            'cache').as_posix()
+        start = time.perf_counter()
+        users, create_trade_seconds = generate_chains(
+            workdir, args.pyomcore_url, args.pyomcash_url,
+            num_users=args.users, num_trades=args.trades,
+            participants_per_trade=args.participants,
+            currencies_per_trade=args.currencies,
+            chain_length=args.chain_length)
+        generate_seconds = time.perf_counter() - start
+        rootdir = users[0].rootdir
+        v, full_seconds = timed(
+            lambda: verify_chain(rootdir, checkpoint=False), args.repeat)
+        verify_chain(rootdir)
+        _, resume_seconds = timed(lambda: verify_chain(rootdir), args.repeat)
+        num_trade_matrices, update_seconds = bench_update_balance_sheet(
+            v, args.repeat)
+        results = {
+            'pyomcash_version': pyomcash.__version__,
+            'python_version': platform.python_version(),
+            'parameters': {
+                'users': args.users,
+                'trades': args.trades,
+                'participants_per_trade': args.participants,
+                'currencies_per_trade': args.currencies,
+                'chain_length': args.chain_length
+            },
+            'numblocks': most_recent_block_idx(rootdir) + 1,
+            'generate_seconds': generate_seconds,
+            'create_trade': summarize(create_trade_seconds),
+            'verify_chain_full': summarize(full_seconds),
+            'verify_chain_from_checkpoint': summarize(resume_seconds),
+            'update_balance_sheet': dict(summarize(update_seconds),
+                                         trade_matrices=num_trade_matrices)
+        }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        pathlib.Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+# Measures the startup time of the pyomcash commands that don't need gpg or
+# pyomcore: validating a trade file with propose_trade --check, and querying
+# the balance index. For reference, it also measures a bare interpreter and
+# the import of the full verifier, which is what every command used to pay.
+# Each command is run in a fresh process, and the median wall time is
+# reported.
+#
+# usage: bench_startup.py [runs] [results.json]
+
+import hashlib
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+
+def fake_fpr(i):
+    return hashlib.sha1(str(i).encode()).hexdigest().upper()
+
+
+def write_trade_csv(path, num_participants=4, num_currencies=100):
+    lines = [','.join([''] + [f'user{j}/pyom/' for j in range(num_participants)])]
+    for i in range(num_currencies):
+        values = [1] * num_participants
+        values[i % num_participants] = 1 - num_participants
+        lines.append(','.join([fake_fpr(i)] + [str(x) for x in values]))
+    path.write_text('\n'.join(lines) + '\n')
+
+
+def time_command(args, cwd, env):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(args, cwd=cwd, env=env, capture_output=True)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            return {'error': result.stderr.decode().strip().splitlines()[-1]}
+    return {'median_seconds': statistics.median(times), 'min_seconds': min(times)}
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = pathlib.Path(tmpdir)
+        env = dict(os.environ, PYOMCASH_CACHE_DIR=tmpdir.joinpath('cache').as_posix())
+        write_trade_csv(tmpdir.joinpath('trade.csv'))
+        commands = {
+            'python': [sys.executable, '-c', 'pass'],
+            'propose_trade_check': [sys.executable, '-m', 'pyomcash.propose_trade', '--check', 'trade.csv'],
+            'balance_index_balances': [sys.executable, '-m', 'pyomcash.balance_index', 'balances'],
+            'import_verifier': [sys.executable, '-c', 'import pyomcash.verifier']
+        }
+        results = {'runs': runs}
+        for name, args in commands.items():
+            results[name] = time_command(args, tmpdir, env)
+    output = json.dumps(results, indent=2)
+    if len(sys.argv) > 2:
+        pathlib.Path(sys.argv[2]).write_text(output)
+    print(output)
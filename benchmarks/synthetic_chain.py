@@ -0,0 +1,110 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+# Generates a set of PYOM users with pyomcash trades between them, for the
+# benchmarks. Works offline: each user gets a local gpg homedir with a fast
+# ed25519 key (instead of RSA-4096), and the smart contracts are cloned from
+# local repos (or any git URL).
+
+import random
+import time
+from datetime import timedelta
+from pyomcore.utils import *
+from pyomcore.initialize_blockchain import initialize_blockchain
+from pyomcore.confirm_transactions import confirm_transactions
+from pyomcore.add_smart_contract import add_smart_contract
+from pyomcash.utils import create_trade
+
+
+class SyntheticUser:
+    def __init__(self, name, gpg_dir, rootdir, fpr):
+        self.name = name
+        self.gpg_dir = gpg_dir
+        self.rootdir = rootdir
+        self.fpr = fpr
+
+    def gpg_ctx(self):
+        return init_local_gpg(self.gpg_dir)
+
+    def append_block(self, protoblock):
+        idx = most_recent_block_idx(self.rootdir)
+        create_block(self.gpg_ctx(), self.rootdir, idx+1, self.fpr, protoblock)
+
+
+def create_user(workdir, name, pyomcore_url, pyomcash_url):
+    userdir = workdir.joinpath(name)
+    gpg_dir = userdir.joinpath('gnupg')
+    gpg_dir.mkdir(parents=True, exist_ok=True)
+    gpg_ctx = init_local_gpg(gpg_dir)
+    gpg_ctx.create_key(name, algorithm='ed25519', sign=True, certify=True)
+    rootdir = userdir.joinpath('pyom')
+    contracts_dir = rootdir.joinpath(smart_contracts_dirname)
+    contracts_dir.mkdir(parents=True, exist_ok=True)
+    for url, subdir in [(pyomcore_url, 'pyomcore'), (pyomcash_url, 'pyomcash')]:
+        result = subprocess.run(
+            ['git', 'clone', str(url), contracts_dir.joinpath(subdir).as_posix()], capture_output=True)
+        result.check_returncode()
+    v = initialize_blockchain(gpg_ctx, rootdir)
+    add_smart_contract(
+        gpg_ctx, rootdir, smart_contracts_dirname.joinpath('pyomcash'))
+    return SyntheticUser(name, gpg_dir, rootdir, v.fpr)
+
+# A zero-sum trade between participants. The first currencies_per_trade
+# participants each pay (n-1) units of their own currency, one to each of the
+# others. Only your own currency can be spent without a balance, so this works
+# however many trades there are.
+
+
+def make_trade_matrix(participants, currencies_per_trade):
+    n = len(participants)
+    trade_matrix = {}
+    for k, user in enumerate(participants[:currencies_per_trade]):
+        trade_matrix[user.fpr] = [-(n-1) if j == k else 1 for j in range(n)]
+    return trade_matrix
+
+# Creates num_users users under workdir and num_trades trades between them,
+# each registered and confirmed by all its participants. Then pads every chain
+# with empty blocks up to chain_length. Returns the users and the time spent in
+# each create_trade call.
+
+
+def generate_chains(workdir, pyomcore_url, pyomcash_url, num_users=4, num_trades=10,
+                    participants_per_trade=2, currencies_per_trade=2, chain_length=0, seed=0):
+    if participants_per_trade > num_users:
+        raise Exception('participants_per_trade is larger than num_users')
+    if currencies_per_trade > participants_per_trade:
+        raise Exception('currencies_per_trade is larger than participants_per_trade')
+    rng = random.Random(seed)
+    users = [create_user(workdir, f'user{i}', pyomcore_url, pyomcash_url)
+             for i in range(num_users)]
+    create_trade_seconds = []
+    for _ in range(num_trades):
+        participants = rng.sample(users, participants_per_trade)
+        rootdirs = [user.rootdir for user in participants]
+        start = time.perf_counter()
+        protoblocks = create_trade(
+            timedelta(days=1), rootdirs, make_trade_matrix(participants, currencies_per_trade))
+        create_trade_seconds.append(time.perf_counter() - start)
+        for user, protoblock in zip(participants, protoblocks):
+            user.append_block(protoblock)
+        for this_user in participants:
+            for that_user in participants:
+                confirm_transactions(this_user.gpg_ctx(), this_user.rootdir,
+                                     that_user.rootdir, confirm_only=False)
+    for user in users:
+        while most_recent_block_idx(user.rootdir) + 1 < chain_length:
+            user.append_block({'actions': []})
+    return users, create_trade_seconds
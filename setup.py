@@ -25,5 +25,8 @@ setup(
     package_dir={'': 'src'},
     packages=['pyomcash'],
     install_requires=['pyomcore'],
+    # NumPy speeds up the checks on large trade matrices, and is needed to
+    # read trade matrices in .npz format.
+    extras_require={'numpy': ['numpy']},
     license='GPLv3',
 )
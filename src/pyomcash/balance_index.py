@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+import pathlib
+import sqlite3
+import sys
+from .cache import cache_dir
+
+# An append-only SQLite index of every change to the balance sheet, filled in
+# by verify_chain(rootdir, index=...). It answers "what was my balance of X at
+# block N" and "which transactions moved X" without replaying the chain.
+#
+# The queries don't import pyomcore or gpg, so they start quickly.
+#
+# usage:
+#   python3 -m pyomcash.balance_index update
+#   python3 -m pyomcash.balance_index balance <fpr> [block]
+#   python3 -m pyomcash.balance_index balances [block]
+#   python3 -m pyomcash.balance_index history <fpr>
+
+index_filename = 'balance_index.sqlite'
+
+schema = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS deltas (
+    block INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    transaction_hash TEXT NOT NULL,
+    action TEXT NOT NULL,
+    fpr TEXT NOT NULL,
+    delta INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deltas_fpr ON deltas (fpr, block);
+CREATE INDEX IF NOT EXISTS deltas_block ON deltas (block);
+'''
+
+
+class BalanceIndex:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(schema)
+        meta = dict(self.db.execute('SELECT key, value FROM meta'))
+        # Blocks 0..next_block-1 are in the index.
+        self._next_block = meta.get('next_block', 0)
+        self.last_hash = meta.get('last_hash')
+        # fpr of the chain's owner
+        self.owner = meta.get('owner')
+        self.last_block = None
+
+    def next_block(self):
+        return self._next_block
+
+    # Empty the index if it doesn't match the chain any more, because the chain
+    # has been rewritten since it was last updated.
+    def check_chain(self, rootdir, numblocks):
+        from .checkpoint import block_hash
+        if self._next_block == 0:
+            return
+        if (self._next_block > numblocks or
+                block_hash(rootdir, self._next_block - 1) != self.last_hash):
+            self.db.execute('DELETE FROM deltas')
+            self.db.execute('DELETE FROM meta')
+            self.db.commit()
+            self._next_block = 0
+            self.last_hash = None
+
+    # Block processor for CashVerifier. Needs v.block_deltas to be enabled.
+    def process_block(self, v, idx, block, touched):
+        if idx < self._next_block:
+            return
+        if idx != self._next_block:
+            raise Exception(
+                f'balance index expected block {self._next_block}, not {idx}')
+        rows = []
+        for transaction_hash, t, (ids, values, sign) in v.block_deltas:
+            for i, value in zip(ids, values):
+                rows.append((idx, len(rows), transaction_hash, t,
+                             v.ledger.fprs[i], sign * value))
+        self.db.executemany(
+            'INSERT INTO deltas VALUES (?, ?, ?, ?, ?, ?)', rows)
+        self._next_block = idx + 1
+        self.owner = v.fpr
+        self.last_block = block
+
+    def commit(self):
+        from .checkpoint import hash_block
+        if self.last_block is not None:
+            self.last_hash = hash_block(self.last_block)
+            self.last_block = None
+        self.db.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', [
+            ('next_block', self._next_block),
+            ('last_hash', self.last_hash),
+            ('owner', self.owner)
+        ])
+        self.db.commit()
+
+    # Balance of currency fpr after block (default: the newest indexed block).
+    def balance(self, fpr, block=None):
+        if block is None:
+            block = self._next_block
+        (total,) = self.db.execute(
+            'SELECT COALESCE(SUM(delta), 0) FROM deltas WHERE fpr = ? AND block <= ?',
+            (fpr, block)).fetchone()
+        return total
+
+    # Balances of all currencies after block, sorted by fingerprint.
+    def balances(self, block=None):
+        if block is None:
+            block = self._next_block
+        return self.db.execute(
+            'SELECT fpr, SUM(delta) FROM deltas WHERE block <= ? GROUP BY fpr ORDER BY fpr',
+            (block,))
+
+    # The currencies whose balances differ between old_block and new_block, as
+    # (fpr, old balance, new balance) sorted by fingerprint. Only the
+    # currencies with changes in between are summed up.
+    def changes(self, old_block, new_block):
+        if old_block > new_block:
+            return [(fpr, old, new) for fpr, new, old in self.changes(new_block, old_block)]
+        return self.db.execute('''
+            SELECT fpr, SUM(CASE WHEN block <= :old THEN delta ELSE 0 END) AS old_total,
+                   SUM(delta) AS new_total
+            FROM deltas
+            WHERE block <= :new AND fpr IN (
+                SELECT fpr FROM deltas WHERE block > :old AND block <= :new)
+            GROUP BY fpr
+            HAVING old_total != new_total
+            ORDER BY fpr''', {'old': old_block, 'new': new_block})
+
+    # Every change to the balance of currency fpr, as
+    # (block, transaction hash, action type, delta), oldest first.
+    def history(self, fpr):
+        return self.db.execute(
+            'SELECT block, transaction_hash, action, delta FROM deltas WHERE fpr = ? ORDER BY block, seq',
+            (fpr,))
+
+    def close(self):
+        self.db.close()
+
+
+def open_balance_index(rootdir):
+    return BalanceIndex(cache_dir(rootdir).joinpath(index_filename))
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    rootdir = pathlib.Path.cwd()
+    if args == ['update']:
+        from .verifier import verify_chain
+        verify_chain(rootdir, index=open_balance_index(rootdir))
+    elif len(args) in (2, 3) and args[0] == 'balance':
+        block = int(args[2]) if len(args) == 3 else None
+        print(open_balance_index(rootdir).balance(args[1], block))
+    elif len(args) in (1, 2) and args[0] == 'balances':
+        block = int(args[1]) if len(args) == 2 else None
+        for fpr, total in open_balance_index(rootdir).balances(block):
+            print(f'{fpr},{total}')
+    elif len(args) == 2 and args[0] == 'history':
+        for block, transaction_hash, t, delta in open_balance_index(rootdir).history(args[1]):
+            print(f'{block},{transaction_hash},{t},{delta}')
+    else:
+        print('usage: balance_index update', file=sys.stderr)
+        print('       balance_index balance <fpr> [block]', file=sys.stderr)
+        print('       balance_index balances [block]', file=sys.stderr)
+        print('       balance_index history <fpr>', file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import json
+import pathlib
+import struct
+import sys
+from .balance_index import open_balance_index
+
+# Machine-readable balance sheets, sorted by currency fingerprint, in one of
+# three formats:
+#
+#   csv       fpr,balance,self|other (the same lines as print_balance_sheet)
+#   jsonl     {"fpr": ..., "balance": ..., "self": true|false}
+#   columnar  a compact binary format: the magic bytes, then one record per
+#             currency, with the fingerprint as 20 raw bytes and the balance
+#             as a little-endian int64, then a trailer with the number of
+#             currencies and the position of your own currency (-1 if it's
+#             not there) as little-endian uint32 and int32
+#
+# The output is written as it's generated, which is why the columnar format
+# has its counts at the end. Fingerprints are compared in upper case, whatever
+# the case they were written in. Two balance sheets can be compared
+# with a diff, which only lists the currencies whose balances differ. The two
+# sides can be dumps from two nodes, or two block heights of the balance index
+# (see balance_index.py), in which case only the currencies that changed in
+# between are read.
+#
+# usage: balance_output dump [--block N] [--format F] [OUTPUT]
+#        balance_output diff OLD_DUMP NEW_DUMP [--format F]
+#        balance_output diff --blocks OLD NEW [--format F]
+
+formats = ('csv', 'jsonl', 'columnar')
+diff_formats = ('csv', 'jsonl')
+
+columnar_magic = b'PYOMBAL2'
+# The columnar format only holds 160-bit (40 hex digit) gpg fingerprints and
+# balances that fit in an int64.
+fpr_bytes = 20
+columnar_record = struct.Struct(f'<{fpr_bytes}sq')
+columnar_trailer = struct.Struct('<Ii')
+min_balance = -2**63
+max_balance = 2**63 - 1
+
+
+def normalize_fpr(fpr):
+    return fpr.upper()
+
+
+def csv_lines(balances, own_fpr):
+    for fpr, balance in balances:
+        comment = 'self' if fpr == own_fpr else 'other'
+        yield f'{fpr},{balance},{comment}\n'
+
+
+def jsonl_lines(balances, own_fpr):
+    for fpr, balance in balances:
+        yield json.dumps({'fpr': fpr, 'balance': balance, 'self': fpr == own_fpr}) + '\n'
+
+
+def write_columnar(f, balances, own_fpr):
+    f.write(columnar_magic)
+    n = 0
+    own_index = -1
+    for fpr, balance in balances:
+        if fpr == own_fpr:
+            own_index = n
+        try:
+            if len(fpr) != 2*fpr_bytes:
+                raise ValueError
+            raw_fpr = bytes.fromhex(fpr)
+        except ValueError:
+            raise Exception(
+                f'columnar format needs {2*fpr_bytes} hex digit fingerprints, not {fpr!r}')
+        if not min_balance <= balance <= max_balance:
+            raise Exception(
+                f'balance {balance} of {fpr} does not fit in the columnar format (int64)')
+        f.write(columnar_record.pack(raw_fpr, balance))
+        n += 1
+    f.write(columnar_trailer.pack(n, own_index))
+
+# Write balances, as (fpr, balance) sorted by fpr, to f in format fmt. f is a
+# binary file for the columnar format, and a text file otherwise.
+
+
+def write_balances(f, balances, fmt, own_fpr=None):
+    if fmt == 'csv':
+        f.writelines(csv_lines(balances, own_fpr))
+    elif fmt == 'jsonl':
+        f.writelines(jsonl_lines(balances, own_fpr))
+    elif fmt == 'columnar':
+        write_columnar(f, balances, own_fpr)
+    else:
+        raise Exception('unknown balance format: ' + fmt)
+
+
+def read_columnar(data):
+    start = len(columnar_magic)
+    if len(data) < start + columnar_trailer.size:
+        raise Exception('truncated columnar balance file')
+    n, own_index = columnar_trailer.unpack_from(data, len(data) - columnar_trailer.size)
+    end = start + n*columnar_record.size
+    if len(data) != end + columnar_trailer.size:
+        raise Exception(
+            f'columnar balance file should be {end + columnar_trailer.size} bytes '
+            f'for {n} currencies, not {len(data)}')
+    if not -1 <= own_index < n:
+        raise Exception(f'bad own currency position in columnar balance file: {own_index}')
+    return [(raw_fpr.hex(), balance)
+            for raw_fpr, balance in columnar_record.iter_unpack(data[start:end])]
+
+# Read a balance sheet written in any of the formats (or by the verifier),
+# as a list of (fpr, balance) sorted by fpr, with the fingerprints in upper
+# case.
+
+
+def read_balances(path):
+    data = pathlib.Path(path).read_bytes()
+    if data.startswith(columnar_magic):
+        balances = read_columnar(data)
+    else:
+        balances = read_text_balances(path, data)
+    balances = [(normalize_fpr(fpr), balance) for fpr, balance in balances]
+    balances.sort()
+    return balances
+
+
+def read_text_balances(path, data):
+    balances = []
+    for lineno, line in enumerate(data.decode().splitlines(), 1):
+        line = line.strip()
+        if line == '':
+            continue
+        try:
+            if line.startswith('{'):
+                row = json.loads(line)
+                balances.append((row['fpr'], row['balance']))
+            else:
+                fpr, balance = line.split(',')[:2]
+                balances.append((fpr, int(balance)))
+        except (ValueError, KeyError) as e:
+            raise Exception(f'{path}:{lineno}: {e}')
+    return balances
+
+# Compare two balance sheets, as (fpr, balance) sorted by fpr. Yields
+# (fpr, old balance, new balance) for every currency whose balance differs. A
+# currency that is missing on one side has a balance of 0 there.
+
+
+def diff_balances(old, new):
+    old = iter(old)
+    new = iter(new)
+    a = next(old, None)
+    b = next(new, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and a[0] < b[0]):
+            fpr, old_balance, new_balance = a[0], a[1], 0
+            a = next(old, None)
+        elif a is None or b[0] < a[0]:
+            fpr, old_balance, new_balance = b[0], 0, b[1]
+            b = next(new, None)
+        else:
+            fpr, old_balance, new_balance = a[0], a[1], b[1]
+            a = next(old, None)
+            b = next(new, None)
+        if old_balance != new_balance:
+            yield fpr, old_balance, new_balance
+
+
+def write_diff(f, diff, fmt):
+    if fmt == 'csv':
+        f.writelines(f'{fpr},{old_balance},{new_balance},{new_balance - old_balance}\n'
+                     for fpr, old_balance, new_balance in diff)
+    elif fmt == 'jsonl':
+        f.writelines(json.dumps({'fpr': fpr, 'old': old_balance, 'new': new_balance,
+                                 'delta': new_balance - old_balance}) + '\n'
+                     for fpr, old_balance, new_balance in diff)
+    else:
+        raise Exception('unknown diff format: ' + fmt)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='balance_output')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    dump = subparsers.add_parser('dump', help='dump the balances from the balance index')
+    dump.add_argument('--block', type=int,
+                      help='balances after this block (default: the newest indexed block)')
+    dump.add_argument('--format', choices=formats, default='csv')
+    dump.add_argument('output', nargs='?', help='default: stdout')
+    diff = subparsers.add_parser('diff', help='compare two balance sheets')
+    diff.add_argument('--blocks', action='store_true',
+                      help='OLD and NEW are block heights in the balance index')
+    diff.add_argument('--format', choices=diff_formats, default='csv')
+    diff.add_argument('old')
+    diff.add_argument('new')
+    args = parser.parse_args()
+    rootdir = pathlib.Path.cwd()
+    if args.command == 'dump':
+        index = open_balance_index(rootdir)
+        balances = index.balances(args.block)
+        mode = 'wb' if args.format == 'columnar' else 'w'
+        if args.output is not None:
+            with open(args.output, mode) as f:
+                write_balances(f, balances, args.format, index.owner)
+        elif args.format == 'columnar':
+            write_balances(sys.stdout.buffer, balances, args.format, index.owner)
+        else:
+            write_balances(sys.stdout, balances, args.format, index.owner)
+    elif args.blocks:
+        index = open_balance_index(rootdir)
+        write_diff(sys.stdout, index.changes(int(args.old), int(args.new)), args.format)
+    else:
+        write_diff(sys.stdout, diff_balances(read_balances(args.old),
+                   read_balances(args.new)), args.format)
@@ -0,0 +1,82 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+
+# Checkpoints and other derived state are cached outside the PYOM repo, so that
+# they never show up in the blockchain directory or the smart contract's file
+# hashes. Set PYOMCASH_CACHE_DIR to move the cache somewhere else.
+#
+# This module doesn't import pyomcore or gpg, so that read-only commands which
+# only need the cache start quickly.
+cache_dir_envvar = 'PYOMCASH_CACHE_DIR'
+
+author_keys_filename = 'author_keys.json'
+
+# Directory for cached state about the chain in rootdir. Each chain gets its own
+# subdirectory, named after the hash of its absolute path.
+
+
+def cache_dir(rootdir):
+    basedir = os.environ.get(cache_dir_envvar)
+    if basedir is None:
+        xdg_cache_home = os.environ.get('XDG_CACHE_HOME')
+        if xdg_cache_home is None:
+            xdg_cache_home = pathlib.Path.home().joinpath('.cache')
+        basedir = pathlib.Path(xdg_cache_home).joinpath('pyomcash')
+    key = hashlib.sha256(
+        pathlib.Path(rootdir).resolve().as_posix().encode()).hexdigest()
+    d = pathlib.Path(basedir).joinpath(key[:32])
+    d.mkdir(mode=0o700, parents=True, exist_ok=True)
+    return d
+
+# The fingerprints of public keys that have already been imported into the gpg
+# homedir of rootdir, by SHA-512 of the key file.
+
+
+def load_author_keys(rootdir):
+    path = cache_dir(rootdir).joinpath(author_keys_filename)
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_author_key(rootdir, key_hash, fpr):
+    keys = load_author_keys(rootdir)
+    keys[key_hash] = fpr
+    write_atomic(cache_dir(rootdir).joinpath(author_keys_filename),
+                 json.dumps(keys).encode())
+
+# Replace the file at path with data. The data is written to a temporary file
+# with a unique name first, so that other processes writing the same file at
+# the same time never see or clobber a half-written one.
+
+
+def write_atomic(path, data):
+    fd, tmpname = tempfile.mkstemp(
+        dir=path.parent, prefix=path.name + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmpname, path)
+    except BaseException:
+        pathlib.Path(tmpname).unlink(missing_ok=True)
+        raise
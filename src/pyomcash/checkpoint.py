@@ -0,0 +1,143 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+import functools
+import hashlib
+import importlib.metadata
+import json
+import pathlib
+import pickle
+import sys
+from pyomcore.utils import *
+from . import __version__
+from .utils import *
+from .cache import write_atomic
+
+# A checkpoint is a pickled copy of the verifier state after block idx,
+# together with the hash of that block. verify_chain uses the newest checkpoint
+# whose block hash still matches the chain, and only verifies the blocks after
+# it. Checkpoints live in cache_dir(rootdir), which is private to the user, so
+# unpickling them is no less safe than running the verifier itself. State
+# that comes from another machine is never unpickled: snapshots (see
+# snapshot.py) carry it as plain JSON data.
+
+# Bump this whenever the layout of the CashVerifier state changes, so that old
+# checkpoints are ignored rather than restored into the wrong shape. The state
+# includes the core Verifier's attributes, so the installed pyomcore version is
+# part of the key as well.
+checkpoint_format = 5
+
+# Number of checkpoints to keep for each chain.
+max_checkpoints = 3
+
+
+# The version of the installed pyomcore. When pyomcore isn't installed as a
+# package (e.g. it's on PYTHONPATH), a hash of the core verifier's source
+# stands in for it.
+
+
+@functools.lru_cache(maxsize=None)
+def pyomcore_version():
+    try:
+        return importlib.metadata.version('pyomcore')
+    except importlib.metadata.PackageNotFoundError:
+        import pyomcore.verifier
+        source = pathlib.Path(pyomcore.verifier.__file__).read_bytes()
+        return 'src-' + hashlib.sha256(source).hexdigest()[:16]
+
+
+def contract_version():
+    return f'{__version__}/{checkpoint_format}/{pyomcore_version()}/{pyomcash_uuid_hash}'
+
+# SHA-512 of the canonical JSON encoding of a block.
+
+
+def hash_block(block):
+    data = json.dumps(block, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha512(data.encode()).hexdigest()
+
+
+def block_hash(rootdir, idx):
+    return hash_block(load_block(rootdir, idx))
+
+
+def checkpoint_path(rootdir, idx):
+    return cache_dir(rootdir).joinpath(f'checkpoint_{idx:010}.pickle')
+
+
+def list_checkpoints(rootdir):
+    return sorted(cache_dir(rootdir).glob('checkpoint_*.pickle'), reverse=True)
+
+# The state of verifier v that goes into a checkpoint. The gpg context and
+# block processors are tied to this process, so they are recreated on load.
+
+
+def checkpoint_state(v):
+    state = dict(v.__dict__)
+    for attr in v.transient_attrs:
+        del state[attr]
+    return state
+
+# Save the state of verifier v, which has verified blocks 0..idx.
+
+
+def save_checkpoint(v, idx):
+    checkpoint = {
+        'version': contract_version(),
+        'idx': idx,
+        'block_hash': block_hash(v.rootdir, idx),
+        'state': checkpoint_state(v)
+    }
+    try:
+        data = pickle.dumps(checkpoint, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError) as e:
+        print('Could not save checkpoint:', e, file=sys.stderr)
+        return
+    write_atomic(checkpoint_path(v.rootdir, idx), data)
+    # Another process may be pruning the same checkpoints.
+    for oldpath in list_checkpoints(v.rootdir)[max_checkpoints:]:
+        oldpath.unlink(missing_ok=True)
+
+# Find the newest usable checkpoint for a chain with numblocks blocks. Returns
+# (idx, state) or None. A checkpoint is skipped if it was written by a
+# different version of the contract, or if the block it was taken at is no
+# longer part of the chain.
+
+
+def load_checkpoint(rootdir, numblocks):
+    for path in list_checkpoints(rootdir):
+        try:
+            checkpoint = pickle.loads(path.read_bytes())
+        except FileNotFoundError:
+            # pruned by another process in the meantime
+            continue
+        except Exception as e:
+            print(f'Ignoring unreadable checkpoint {path}:', e, file=sys.stderr)
+            continue
+        if checkpoint.get('version') != contract_version():
+            continue
+        idx = checkpoint['idx']
+        if idx >= numblocks:
+            continue
+        if block_hash(rootdir, idx) != checkpoint['block_hash']:
+            continue
+        return idx, checkpoint['state']
+    return None
+
+
+def clear_checkpoints(rootdir):
+    for path in list_checkpoints(rootdir):
+        path.unlink(missing_ok=True)
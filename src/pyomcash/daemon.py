@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import collections
+import http.server
+import json
+import os
+import pathlib
+import socketserver
+import sys
+import threading
+import time
+import urllib.parse
+from pyomcore.verifier import check_blockchain_dir
+from .verifier import CashVerifier, verify_chain
+from .checkpoint import block_hash, load_checkpoint, save_checkpoint
+
+# Keeps a CashVerifier in memory, verifies new blocks as they are appended to
+# the chain, and serves the current state over HTTP, either on a local TCP port
+# or on a Unix socket:
+#
+#   GET /balances                the balance sheet, as {fpr: balance}
+#   GET /transactions?limit=N    the most recent pyomcash transaction actions
+#                                verified since the daemon started
+#   GET /status                  the owner fpr and the number of verified blocks
+#
+# The chain is watched with inotify if the inotify_simple package is
+# installed, otherwise it is polled.
+#
+# usage: daemon [--port N | --socket PATH] [--interval SECONDS]
+
+
+class CashDaemon:
+    def __init__(self, rootdir, max_recent=1000, checkpoint_interval=60):
+        self.rootdir = rootdir
+        # Guards the state that the queries read, which is published after
+        # every successful refresh. The verifier itself is only used by the
+        # thread that refreshes it, so queries never wait for blocks to be
+        # verified or for checkpoints to be saved.
+        self.lock = threading.Lock()
+        # (block idx, transaction hash, action type), newest last
+        self.recent = collections.deque(maxlen=max_recent)
+        # The actions of the blocks verified since the last publish
+        self.pending = []
+        # Checkpoints pickle the whole verifier state, so they are saved at
+        # most every checkpoint_interval seconds.
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_time = time.time()
+        numblocks = check_blockchain_dir(self.rootdir)
+        self.reload(numblocks)
+        self.publish(numblocks)
+
+    # Verify blocks 0..numblocks-1 from the last checkpoint, e.g. at startup or
+    # after the chain has been rewritten.
+    def reload(self, numblocks):
+        self.v = None
+        self.pending.clear()
+        self.v = verify_chain(self.rootdir, block_processors=[self.record_actions],
+                              numblocks=numblocks)
+
+    def record_actions(self, v, idx, block, touched):
+        for t, transaction_hash, transaction_status in touched:
+            if transaction_hash in v.transaction_states:
+                self.pending.append((idx, transaction_hash, t))
+
+    # Make the state of the verifier, which has verified blocks
+    # 0..numblocks-1, visible to the queries. If replace is True, the recent
+    # actions from before are forgotten.
+    def publish(self, numblocks, replace=False):
+        balances = self.v.balance_sheet
+        last_hash = block_hash(self.rootdir, numblocks - 1)
+        with self.lock:
+            if replace:
+                self.recent.clear()
+            self.recent.extend(self.pending)
+            self.balance_sheet = balances
+            self.fpr = self.v.fpr
+            self.numblocks = numblocks
+            self.last_hash = last_hash
+            self.updated = time.time()
+            self.error = None
+        self.pending.clear()
+
+    # Verify the blocks appended since the last refresh. Returns the number of
+    # new blocks.
+    def refresh(self):
+        numblocks = check_blockchain_dir(self.rootdir)
+        if (self.v is None or numblocks < self.numblocks or
+                block_hash(self.rootdir, self.numblocks - 1) != self.last_hash):
+            self.reload(numblocks)
+            self.publish(numblocks, replace=True)
+            return numblocks
+        if numblocks == self.numblocks:
+            return 0
+        for idx in range(self.numblocks, numblocks):
+            try:
+                self.v.verify_block(idx)
+            except Exception as e:
+                print(f'Error in block {idx}:', e, file=sys.stderr)
+                error = f'Blockchain verification failed in block {idx}'
+                with self.lock:
+                    self.error = error
+                self.roll_back()
+                raise Exception(error)
+        new_blocks = numblocks - self.numblocks
+        self.publish(numblocks)
+        if time.time() - self.checkpoint_time >= self.checkpoint_interval:
+            save_checkpoint(self.v, numblocks - 1)
+            self.checkpoint_time = time.time()
+        return new_blocks
+
+    # The verifier may be half way through a block, so go back to the
+    # published state, from its checkpoint if there is one, or else by
+    # verifying the chain up to there again. The actions of the rolled back
+    # blocks were never published, and are dropped.
+    def roll_back(self):
+        self.pending.clear()
+        saved = load_checkpoint(self.rootdir, self.numblocks)
+        if saved is not None and saved[0] == self.numblocks - 1:
+            try:
+                v = CashVerifier.from_state(self.rootdir, self.v.gpg_ctx, saved[1])
+                v.add_block_processor(self.record_actions)
+                self.v = v
+                return
+            except Exception as e:
+                print('Error restoring the checkpoint:', e, file=sys.stderr)
+        # If this fails too, self.v stays None, and the next refresh starts
+        # again from the last checkpoint.
+        try:
+            self.reload(self.numblocks)
+        except Exception as e:
+            print('Error verifying the chain again:', e, file=sys.stderr)
+        self.pending.clear()
+
+    def balances(self):
+        with self.lock:
+            return self.balance_sheet
+
+    def transactions(self, limit):
+        with self.lock:
+            recent = list(self.recent)[-limit:]
+        return [{'block': idx, 'transaction': transaction_hash, 'action': t}
+                for idx, transaction_hash, t in recent]
+
+    def status(self):
+        with self.lock:
+            return {
+                'fpr': self.fpr,
+                'numblocks': self.numblocks,
+                'updated': self.updated,
+                'error': self.error
+            }
+
+    # Refresh whenever the chain changes, or at least every interval seconds.
+    def run(self, interval):
+        for _ in watch_chain(self.rootdir, interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(e, file=sys.stderr)
+
+# Yields whenever something might have changed under rootdir, and at least
+# every interval seconds.
+
+
+def watch_chain(rootdir, interval):
+    try:
+        import inotify_simple
+    except ImportError:
+        inotify_simple = None
+    if inotify_simple is None:
+        while True:
+            time.sleep(interval)
+            yield
+    inotify = inotify_simple.INotify()
+    flags = (inotify_simple.flags.CREATE | inotify_simple.flags.MOVED_TO |
+             inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.DELETE)
+    inotify.add_watch(rootdir, flags)
+    for d in rootdir.iterdir():
+        if d.is_dir() and not d.name.startswith('.'):
+            inotify.add_watch(d, flags)
+    while True:
+        inotify.read(timeout=int(interval * 1000))
+        yield
+
+
+def make_handler(daemon):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            query = urllib.parse.parse_qs(url.query)
+            if url.path == '/balances':
+                self.send_json(daemon.balances())
+            elif url.path == '/transactions':
+                try:
+                    limit = int(query.get('limit', ['100'])[0])
+                except ValueError:
+                    self.send_error(400, 'limit must be an integer')
+                    return
+                if limit < 0:
+                    self.send_error(400, 'limit must not be negative')
+                    return
+                self.send_json(daemon.transactions(limit))
+            elif url.path == '/status':
+                self.send_json(daemon.status())
+            else:
+                self.send_error(404)
+
+        def send_json(self, value):
+            body = json.dumps(value).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # Unix socket clients don't have an address.
+        def address_string(self):
+            return str(self.client_address or 'local')
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='daemon')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--port', type=int, default=8637,
+                       help='serve on 127.0.0.1:PORT (default: 8637)')
+    group.add_argument('--socket', help='serve on a Unix socket instead')
+    parser.add_argument('--interval', type=float, default=5,
+                        help='check the chain at least every INTERVAL seconds')
+    args = parser.parse_args()
+    daemon = CashDaemon(pathlib.Path.cwd())
+    handler = make_handler(daemon)
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = UnixHTTPServer(args.socket, handler)
+    else:
+        server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', args.port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    daemon.run(args.interval)
@@ -0,0 +1,135 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+
+# One participant's column of a trade matrix, with the currency fingerprints
+# replaced by ledger ids and split into the values that are spent (debits,
+# value < 0) and the values that are received (credits, value >= 0). The
+# split matches update_balance_sheet: spending happens when a transaction is
+# registered, receiving when it is confirmed.
+TradeColumn = namedtuple(
+    'TradeColumn', ['debit_ids', 'debit_values', 'credit_ids', 'credit_values'])
+
+# The validated pyomcash view of a transaction: the verifier's column index
+# in the trade matrices, and (author set, TradeColumn) for each pyomcash
+# contract. Defined here rather than in verifier.py so that checkpoints can be
+# unpickled when the verifier is run as __main__.
+CashView = namedtuple('CashView', ['index', 'contracts'])
+
+# Balances indexed by a dense integer id per currency fingerprint, so that the
+# balance updates don't need to hash 40-character fingerprints.
+
+
+class Ledger:
+    def __init__(self):
+        self.ids = {}
+        self.fprs = []
+        # None until the currency is first touched by a balance update
+        self.balances = []
+        # ids in the order they were first touched
+        self.order = []
+
+    def intern(self, fpr):
+        i = self.ids.get(fpr)
+        if i is None:
+            i = len(self.fprs)
+            self.ids[fpr] = i
+            self.fprs.append(fpr)
+            self.balances.append(None)
+        return i
+
+    def get(self, fpr, default=0):
+        i = self.ids.get(fpr)
+        if i is None or self.balances[i] is None:
+            return default
+        return self.balances[i]
+
+    def items(self):
+        for i in self.order:
+            yield self.fprs[i], self.balances[i]
+
+    def as_dict(self):
+        return dict(self.items())
+
+    def add(self, ids, values):
+        balances = self.balances
+        for i, value in zip(ids, values):
+            current_balance = balances[i]
+            if current_balance is None:
+                self.order.append(i)
+                current_balance = 0
+            balances[i] = current_balance + value
+
+    def subtract(self, ids, values):
+        balances = self.balances
+        for i, value in zip(ids, values):
+            current_balance = balances[i]
+            if current_balance is None:
+                self.order.append(i)
+                current_balance = 0
+            balances[i] = current_balance - value
+
+    # Check a whole column of debits against the balances at once. Returns
+    # (id, current balance, value) for every debit that can't be afforded. Only
+    # the currency with id own_id (your own currency) is allowed to go negative.
+    # If balance is given, it's a function from id to the current balance, to
+    # check against balances that aren't in the ledger (see simulate.py).
+    def shortfalls(self, ids, values, own_id, balance=None):
+        if balance is None:
+            balances = self.balances
+            return [(i, balances[i] or 0, value) for i, value in zip(ids, values)
+                    if i != own_id and (balances[i] or 0) + value < 0]
+        return [(i, balance(i), value) for i, value in zip(ids, values)
+                if i != own_id and balance(i) + value < 0]
+
+    # The debits of several TradeColumns that can't be afforded together, as
+    # (id, current balance, total value). The debits of each currency are
+    # added up across the columns first, so two columns that could each be
+    # afforded on their own, but not both, are caught.
+    def columns_shortfalls(self, columns, own_id):
+        totals = {}
+        for column in columns:
+            for i, value in zip(column.debit_ids, column.debit_values):
+                totals[i] = totals.get(i, 0) + value
+        return self.shortfalls(list(totals), list(totals.values()), own_id)
+
+    # Spend the debits of a column. Nothing is spent unless all of them can be
+    # afforded.
+    def spend(self, ids, values, own_id):
+        shortfalls = self.shortfalls(ids, values, own_id)
+        if shortfalls:
+            raise Exception(' '.join(
+                f'Current balance of {self.fprs[i]} is {current_balance}, so you cannot spend {-value}.'
+                for i, current_balance, value in shortfalls))
+        self.add(ids, values)
+
+    # Convert column i of trade_matrix to a TradeColumn.
+    def compile_column(self, trade_matrix, i):
+        debit_ids = []
+        debit_values = []
+        credit_ids = []
+        credit_values = []
+        for fpr, values in trade_matrix.items():
+            value = values[i]
+            if value < 0:
+                debit_ids.append(self.intern(fpr))
+                debit_values.append(value)
+            else:
+                credit_ids.append(self.intern(fpr))
+                credit_values.append(value)
+        return TradeColumn(tuple(debit_ids), tuple(debit_values),
+                           tuple(credit_ids), tuple(credit_values))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import pathlib
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from .verifier import verify_chain
+
+# Verify the chains of all the participants of a trade at the same time, each
+# in its own process, and then check that every pyomcash transaction they share
+# has been treated the same way on all of them.
+#
+# usage: multichain path/to/pyom_repo1 path/to/pyom_repo2 ...
+
+# How far each action type gets a transaction, for the consistency check.
+# Annulling and reinstating are local decisions, so a transaction that was
+# annulled still counts as confirmed.
+action_phases = {
+    'register_transaction': 'registered',
+    'confirm_transaction': 'confirmed',
+    'annul_transaction': 'confirmed',
+    'reinstate_transaction': 'confirmed',
+    'cancel_transaction': 'cancelled'
+}
+
+# Runs in a worker process. Returns a summary of the chain that can be sent
+# back to the parent process.
+
+
+def summarize_chain(rootdir):
+    try:
+        v = verify_chain(rootdir)
+    except Exception as e:
+        return {'rootdir': rootdir.as_posix(), 'error': str(e)}
+    transactions = {}
+    for transaction_hash, t in v.transaction_states.items():
+        transaction = v.transactions[transaction_hash].transaction
+        transactions[transaction_hash] = {
+            'state': t,
+            'participants': list(map(lambda p: p['gpg'], transaction['participants']))
+        }
+    return {
+        'rootdir': rootdir.as_posix(),
+        'fpr': v.fpr,
+        'balance_sheet': v.balance_sheet,
+        'transactions': transactions
+    }
+
+# Compare the states of the shared transactions. The status of a transaction
+# is 'settled' if it is confirmed on all the verified chains of its
+# participants, 'pending' if it is confirmed on some and registered on the
+# others, 'void' if it is confirmed on none, and 'inconsistent' if it is
+# confirmed on some but cancelled on, or missing from, others.
+
+
+def check_consistency(summaries):
+    chains = {s['fpr']: s for s in summaries if 'error' not in s}
+    report = {}
+    for summary in chains.values():
+        for transaction_hash, info in summary['transactions'].items():
+            if transaction_hash in report:
+                continue
+            states = {}
+            unverified = []
+            for fpr in info['participants']:
+                if fpr not in chains:
+                    unverified.append(fpr)
+                    continue
+                other = chains[fpr]['transactions'].get(transaction_hash)
+                states[fpr] = None if other is None else other['state']
+            phases = set(action_phases.get(t, 'missing') for t in states.values())
+            if phases == {'confirmed'}:
+                status = 'settled'
+            elif 'confirmed' not in phases:
+                status = 'void'
+            elif phases == {'confirmed', 'registered'}:
+                status = 'pending'
+            else:
+                status = 'inconsistent'
+            report[transaction_hash] = {
+                'status': status,
+                'states': states,
+                'unverified': unverified
+            }
+    return report
+
+# Verify the chains in rootdirs in up to jobs processes (default: one per
+# chain). Returns {'chains': [summary of each chain], 'transactions': report}.
+
+
+def verify_chains(rootdirs, jobs=None):
+    rootdirs = [pathlib.Path(rootdir).resolve() for rootdir in rootdirs]
+    if jobs is None:
+        jobs = len(rootdirs)
+    with ProcessPoolExecutor(max(1, min(jobs, len(rootdirs)))) as executor:
+        summaries = list(executor.map(summarize_chain, rootdirs))
+    return {
+        'chains': summaries,
+        'transactions': check_consistency(summaries)
+    }
+
+
+def is_consistent(result):
+    return (all('error' not in s for s in result['chains']) and
+            all(r['status'] != 'inconsistent' for r in result['transactions'].values()))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print('usage: multichain path/to/pyom_repo ...', file=sys.stderr)
+        sys.exit(1)
+    result = verify_chains(sys.argv[1:])
+    json.dump(result, sys.stdout, indent=2)
+    print()
+    if not is_consistent(result):
+        sys.exit(1)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import pathlib
+import sys
+from .trades import read_trade_batch
+from .validation import check_trade_matrix
+
+# Compresses a batch of pending trades into an equivalent, smaller set. For
+# each currency, the values that each participant would pay or receive across
+# all the trades are added up. Participants and currencies that net to zero
+# are dropped, and the rest are split into independent trades: two
+# participants end up in the same netted trade only if a currency connects
+# them. So every participant registers at most one transaction, and each
+# netted trade only involves the participants it has to.
+#
+# Netting changes what is atomic: the original trades would each have
+# succeeded or failed on their own, the netted ones succeed or fail as a
+# whole. It also reduces how much each participant has to spend at
+# registration, so trades that would have failed the balance check on their
+# own can succeed once netted.
+#
+# usage: netting dir_or_jsonl netted.jsonl [report.json]
+#
+# reads a batch of trades (see trades.py) and writes the netted trades in the
+# JSON Lines batch format. propose_trade --batch needs every trade in a batch
+# to have the same participant in column 1, so if the netted trades have more
+# than one, they are split into one file per column 1 participant:
+# netted.0.jsonl, netted.1.jsonl and so on. The report lists the files and
+# whose chain each of them is for.
+
+
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        self.parent.setdefault(x, x)
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, x, y):
+        self.parent[self.find(x)] = self.find(y)
+
+# trades is a list of (rootdirs, trade_matrix). Returns (netted_trades,
+# report), where netted_trades is in the same form. Within each netted trade,
+# the participants keep the order in which they first appear in trades, so
+# the column 1 participant of the first trade stays in column 1.
+
+
+def net_trades(trades):
+    participants = {}
+    # net[fpr][rootdir] is the total value of currency fpr for rootdir
+    net = {}
+    gross = {}
+    for n, (rootdirs, trade_matrix) in enumerate(trades):
+        if not isinstance(trade_matrix, dict):
+            trade_matrix = trade_matrix.to_dict()
+        try:
+            check_trade_matrix(len(rootdirs), trade_matrix)
+        except Exception as e:
+            raise Exception(f'trade {n}: {e}')
+        for rootdir in rootdirs:
+            participants.setdefault(rootdir, len(participants))
+        for fpr, values in trade_matrix.items():
+            row = net.setdefault(fpr, {})
+            for rootdir, value in zip(rootdirs, values):
+                row[rootdir] = row.get(rootdir, 0) + value
+                if value > 0:
+                    gross[fpr] = gross.get(fpr, 0) + value
+    components = UnionFind()
+    for fpr, row in net.items():
+        nonzero = [rootdir for rootdir, value in row.items() if value != 0]
+        for rootdir in nonzero:
+            components.union(rootdir, nonzero[0])
+    # root of component -> (rootdirs, trade_matrix)
+    netted = {}
+    for fpr, row in net.items():
+        nonzero = [rootdir for rootdir, value in row.items() if value != 0]
+        if nonzero:
+            trade = netted.setdefault(components.find(nonzero[0]), {})
+            trade[fpr] = row
+    netted_trades = []
+    for trade in netted.values():
+        rootdirs = sorted(set(rootdir for row in trade.values() for rootdir, value in row.items() if value != 0),
+                          key=lambda rootdir: participants[rootdir])
+        trade_matrix = {fpr: [row.get(rootdir, 0) for rootdir in rootdirs]
+                        for fpr, row in trade.items()}
+        netted_trades.append((rootdirs, trade_matrix))
+    report = reconcile(trades, netted_trades, net, gross, participants)
+    return netted_trades, report
+
+# Which original trades went into which netted trade, and how much was netted
+# away in each currency. An original trade went into the netted trades that
+# carry the currencies it moved. A trade whose currencies all netted to zero
+# didn't go into any.
+
+
+def reconcile(trades, netted_trades, net, gross, participants):
+    netted_participants = [set(rootdirs) for rootdirs, trade_matrix in netted_trades]
+    # fpr -> index of the netted trade that carries it
+    carried_by = {fpr: k for k, (rootdirs, trade_matrix) in enumerate(netted_trades)
+                  for fpr in trade_matrix}
+    originals = []
+    for n, (rootdirs, trade_matrix) in enumerate(trades):
+        into = set(carried_by[fpr] for fpr, values in trade_matrix.items()
+                   if fpr in carried_by and any(value != 0 for value in values))
+        originals.append({'trade': n, 'netted_trades': sorted(into)})
+    currencies = {}
+    for fpr, row in net.items():
+        currencies[fpr] = {
+            'gross': gross.get(fpr, 0),
+            'net': sum(value for value in row.values() if value > 0)
+        }
+    active = set().union(*netted_participants)
+    return {
+        'original_trades': originals,
+        'netted_trades': [{'rootdirs': [rootdir.as_posix() for rootdir in rootdirs],
+                           'currencies': len(trade_matrix)}
+                          for rootdirs, trade_matrix in netted_trades],
+        'currencies': currencies,
+        'dropped_participants': [rootdir.as_posix() for rootdir in participants
+                                 if rootdir not in active]
+    }
+
+# Net the trades and create the netted ones. Returns (protoblocks of each
+# netted trade, as returned by create_trade, report).
+
+
+def create_netted_trades(expiry_delta, trades):
+    from .utils import create_trade_protoblocks
+    netted_trades, report = net_trades(trades)
+    if len(netted_trades) == 0:
+        return [], report
+    return create_trade_protoblocks(expiry_delta, netted_trades), report
+
+# Group the netted trades by their column 1 participant, who has to propose
+# them. Returns a dict from rootdir to a list of trades, in the order in which
+# the participants first appear.
+
+
+def split_by_proposer(netted_trades):
+    batches = {}
+    for rootdirs, trade_matrix in netted_trades:
+        batches.setdefault(rootdirs[0], []).append((rootdirs, trade_matrix))
+    return batches
+
+
+def write_batch(path, trades):
+    with open(path, 'w') as f:
+        for rootdirs, trade_matrix in trades:
+            json.dump({'rootdirs': [rootdir.as_posix() for rootdir in rootdirs],
+                       'trade_matrix': trade_matrix}, f)
+            f.write('\n')
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        print('usage: netting dir_or_jsonl netted.jsonl [report.json]', file=sys.stderr)
+        sys.exit(1)
+    netted_trades, report = net_trades(read_trade_batch(sys.argv[1]))
+    batches = split_by_proposer(netted_trades)
+    output = pathlib.Path(sys.argv[2])
+    if len(batches) > 1:
+        paths = [output.with_name(f'{output.stem}.{k}{output.suffix}')
+                 for k in range(len(batches))]
+    else:
+        paths = [output]
+    if len(batches) == 0:
+        write_batch(output, [])
+    report['batches'] = []
+    for path, (rootdir, trades) in zip(paths, batches.items()):
+        write_batch(path, trades)
+        report['batches'].append({'path': path.as_posix(), 'proposer': rootdir.as_posix()})
+    if len(sys.argv) == 4:
+        pathlib.Path(sys.argv[3]).write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
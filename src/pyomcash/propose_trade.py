@@ -16,49 +16,68 @@
 # You should have received a copy of the GNU General Public License
 # along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
 
-import csv
-import gpg
 import pathlib
 import sys
 from datetime import timedelta
-from pyomcore.verifier import verify_chain
-from .utils import create_trade
+from .trades import read_trade_file, read_trade_batch
 
 # For simple trades, where two PYOMers want to trade their own currencies, use
 # propose_simple_trade.py. This script is for more complex trades. The trades need
-# to be supplied as a CSV file:
+# to be supplied as a CSV file (or a NumPy .npz file for very large trades), in
+# the format described in trades.py.
 #
-# ,user0/pyom/,user1/pyom/,user2/pyom/,user3/pyom/
-# 96184222620D63E9F0EE9D092A5D1800F9270BD8,-3,1,1,1
-# 34494EA12F87A474B5028BC9D1C968A30BB32446,2,-6,2,2
-# 5DDC3FDE29D8C7763E076FE3DA5FBBE24247EC55,3,3,-9,3
-# 2B92F7405A555697A0F401CCCAC5100A0CB0FEC7,4,4,4,-12
+# With --batch, many trades are created in one pass, from a directory of CSV
+# files or a JSON Lines file (see trades.py). All the trades must have the
+# current user in column 1. They are registered together, in a single block.
 #
-# The first row is a list of pyom directories, with the current user in column 1.
-# Then there's one row for each currency, with the gpg fingerprint of the currency
-# in column 0 and a value for each user in the other columns. The values in each
-# row should sum to zero.
+# With --check, the trades are only read and validated, and nothing is
+# created. gpg and pyomcore are only imported when they are needed, so --check
+# starts quickly.
+
+
+def usage():
+    print('usage: propose_trade <expiry days> trade_matrix.csv', file=sys.stderr)
+    print('       propose_trade <expiry days> --batch dir_or_jsonl', file=sys.stderr)
+    print('       propose_trade --check trade_matrix.csv_or_dir_or_jsonl', file=sys.stderr)
+    sys.exit(1)
+
+
+def read_trades(path):
+    if pathlib.Path(path).suffix in ('.csv', '.npz'):
+        return [read_trade_file(path)]
+    return read_trade_batch(path)
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print('usage: propose_trade <expiry days> trade_matrix.csv', file=sys.stderr)
-        sys.exit(1)
+    if len(sys.argv) == 3 and sys.argv[1] == '--check':
+        trades = read_trades(sys.argv[2])
+        print(f'{len(trades)} trades OK')
+        sys.exit(0)
+    if len(sys.argv) == 4 and sys.argv[2] == '--batch':
+        batch = True
+    elif len(sys.argv) == 3:
+        batch = False
+    else:
+        usage()
+    import gpg
+    from pyomcore.verifier import verify_chain
+    from .utils import create_trade, create_trades
     expiry_delta = timedelta(int(sys.argv[1]))
-    reader = csv.reader(open(sys.argv[2], mode='r'), skipinitialspace=True)
-    firstrow = next(reader)
-    n = len(firstrow)
-    if n < 2:
-        raise Exception('csv file should have at least 2 columns')
-    if firstrow[0] != '':
-        raise Exception('first cell of first row should be empty')
-    rootdirs = list(map(lambda p: pathlib.Path(p).resolve(), firstrow[1:]))
-    trade_matrix = {}
-    for row in reader:
-        if len(row) != n:
-            raise Exception(
-                f'row is length {len(row)} but expected {n}: {row}')
-        trade_matrix[row[0]] = list(map(lambda x: int(x), row[1:]))
-    protoblocks = create_trade(expiry_delta, rootdirs, trade_matrix)
+    if batch:
+        trades = read_trade_batch(sys.argv[3])
+        if len(trades) == 0:
+            raise Exception('no trades found in ' + sys.argv[3])
+        rootdir = trades[0][0][0]
+        for rootdirs, trade_matrix in trades:
+            if rootdirs[0] != rootdir:
+                raise Exception(
+                    f'all trades should have {rootdir} in column 1, not {rootdirs[0]}')
+        protoblock = create_trades(expiry_delta, trades)[rootdir]
+    else:
+        rootdirs, trade_matrix = read_trade_file(sys.argv[2])
+        rootdir = rootdirs[0]
+        protoblock = create_trade(expiry_delta, rootdirs, trade_matrix)[0]
     # Register the transaction in the rootdir from the first column. Can't do
     # it for the other columens because those PYOMers need to do it themselves.
-    v = verify_chain(rootdirs[0])
-    v.append_block(gpg.Context(), protoblocks[0])
+    v = verify_chain(rootdir)
+    v.append_block(gpg.Context(), protoblock)
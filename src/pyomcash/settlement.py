@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import contextlib
+import gpg
+import json
+import pathlib
+import sys
+import time
+from datetime import timedelta
+from pyomcore.utils import *
+from pyomcore.confirm_transactions import confirm_transactions
+from .utils import create_trade_protoblocks, combine_trade_protoblocks, trade_transaction_hash
+from .verifier import verify_chain
+from .trades import read_trade_batch
+
+# Settles a round of trades: creates and registers them, then runs the
+# confirmation passes between the participants concurrently, until each trade
+# is confirmed on all its participants' chains or has expired. The blocking
+# pyomcore calls run in threads. Every call holds the locks of the chains it
+# reads or writes, so a chain is never read while it's being written, and at
+# most max_signers gpg signing calls run at once. A trade that fails is
+# reported as 'error', and the others carry on.
+#
+# Only the chains listed in gpg_dirs are written to. gpg_dirs maps each of them
+# to the gpg homedir of its owner (None for the default ~/.gnupg). The other
+# participants register and confirm on their own, and their chains are only
+# read.
+#
+# usage: settlement <expiry days> dir_or_jsonl [max signers]
+#
+# settles a batch of trades (see trades.py) for the PYOM repo in the current
+# directory, and prints one line of JSON for each trade when it finishes.
+
+confirmed_action_types = frozenset(
+    ['confirm_transaction', 'reinstate_transaction'])
+
+
+class Settlement:
+    def __init__(self, gpg_dirs, max_signers=4, poll_interval=1.0):
+        self.gpg_dirs = {pathlib.Path(rootdir).resolve(): gpg_dir
+                         for rootdir, gpg_dir in gpg_dirs.items()}
+        self.max_signers = max_signers
+        self.poll_interval = poll_interval
+        self.locks = {}
+        self.passes = {}
+
+    def gpg_ctx(self, rootdir):
+        gpg_dir = self.gpg_dirs[rootdir]
+        if gpg_dir is None:
+            return gpg.Context()
+        return gpg.Context(home_dir=pathlib.Path(gpg_dir).as_posix())
+
+    def lock(self, rootdir):
+        if rootdir not in self.locks:
+            self.locks[rootdir] = asyncio.Lock()
+        return self.locks[rootdir]
+
+    # Run f(*args) in a thread, holding the locks of rootdirs, and the signing
+    # semaphore if the call signs blocks. The locks are always taken in the
+    # same order, so that two calls which share chains can't deadlock.
+    async def run(self, rootdirs, sign, f, *args):
+        async with contextlib.AsyncExitStack() as stack:
+            for rootdir in sorted(set(rootdirs)):
+                await stack.enter_async_context(self.lock(rootdir))
+            if not sign:
+                return await asyncio.to_thread(f, *args)
+            async with self.signers:
+                return await asyncio.to_thread(f, *args)
+
+    def register(self, rootdir, protoblock):
+        idx = most_recent_block_idx(rootdir)
+        fpr = load_block(rootdir, idx)['owner']['gpg']
+        create_block(self.gpg_ctx(rootdir), rootdir, idx+1, fpr, protoblock)
+
+    # Confirm everything that that_rootdir has registered for this_rootdir. The
+    # pass reads that_rootdir, so it holds that chain's lock too. If the same
+    # pass is already running, wait for it instead of starting another one.
+    async def confirm_pass(self, this_rootdir, that_rootdir):
+        key = (this_rootdir, that_rootdir)
+        task = self.passes.get(key)
+        if task is None or task.done():
+            task = asyncio.ensure_future(self.run(
+                key, True, lambda: confirm_transactions(
+                    self.gpg_ctx(this_rootdir), this_rootdir, that_rootdir, confirm_only=False)))
+            self.passes[key] = task
+        await asyncio.shield(task)
+
+    async def transaction_state(self, rootdir, transaction_hash):
+        v = await self.run([rootdir], False, verify_chain, rootdir)
+        return v.transaction_states.get(transaction_hash)
+
+    async def settle_trade(self, n, rootdirs, transaction_hash, deadline):
+        try:
+            return await self.wait_for_trade(n, rootdirs, transaction_hash, deadline)
+        except Exception as e:
+            print(f'Error in trade {n}:', e, file=sys.stderr)
+            return n, transaction_hash, 'error'
+
+    async def wait_for_trade(self, n, rootdirs, transaction_hash, deadline):
+        while True:
+            await asyncio.gather(*[
+                self.confirm_pass(this_rootdir, that_rootdir)
+                for this_rootdir in rootdirs if this_rootdir in self.gpg_dirs
+                for that_rootdir in rootdirs if that_rootdir != this_rootdir])
+            states = await asyncio.gather(*[
+                self.transaction_state(rootdir, transaction_hash) for rootdir in rootdirs])
+            if all(t in confirmed_action_types for t in states):
+                return n, transaction_hash, 'confirmed'
+            if time.time() > deadline:
+                return n, transaction_hash, 'expired'
+            await asyncio.sleep(self.poll_interval)
+
+    # Async generator which yields (trade number, transaction hash, status).
+    # Every trade is reported as 'registered' once it has been registered on
+    # all the chains in gpg_dirs, and then as 'confirmed', 'expired' or 'error'
+    # as soon as it finishes, in whatever order that happens.
+    async def settle(self, expiry_delta, trades):
+        self.signers = asyncio.Semaphore(self.max_signers)
+        trades = [([pathlib.Path(rootdir).resolve() for rootdir in rootdirs], trade_matrix)
+                  for rootdirs, trade_matrix in trades]
+        # The expiry time is set when the transactions are created.
+        deadline = time.time() + expiry_delta.total_seconds()
+        trade_protoblocks = await asyncio.to_thread(
+            create_trade_protoblocks, expiry_delta, trades)
+        hashes = list(map(trade_transaction_hash, trade_protoblocks))
+        protoblocks = combine_trade_protoblocks(trades, trade_protoblocks)
+        await asyncio.gather(*[
+            self.run([rootdir], True, self.register, rootdir, protoblock)
+            for rootdir, protoblock in protoblocks.items() if rootdir in self.gpg_dirs])
+        for n, transaction_hash in enumerate(hashes):
+            yield n, transaction_hash, 'registered'
+        tasks = [self.settle_trade(n, rootdirs, transaction_hash, deadline)
+                 for n, ((rootdirs, trade_matrix), transaction_hash) in enumerate(zip(trades, hashes))]
+        for task in asyncio.as_completed(tasks):
+            yield await task
+
+
+async def main(expiry_delta, trades, max_signers):
+    settlement = Settlement({pathlib.Path.cwd(): None}, max_signers)
+    async for n, transaction_hash, status in settlement.settle(expiry_delta, trades):
+        print(json.dumps(
+            {'trade': n, 'transaction': transaction_hash, 'status': status}), flush=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        print('usage: settlement <expiry days> dir_or_jsonl [max signers]', file=sys.stderr)
+        sys.exit(1)
+    expiry_delta = timedelta(int(sys.argv[1]))
+    trades = read_trade_batch(sys.argv[2])
+    max_signers = int(sys.argv[3]) if len(sys.argv) == 4 else 4
+    asyncio.run(main(expiry_delta, trades, max_signers))
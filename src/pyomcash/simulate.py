@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import json
+import pathlib
+import sys
+from .trades import TradeMatrix, read_trade_batch
+from .validation import check_trade_matrix
+
+# Checks candidate trades against the balance sheet of a verified chain
+# without writing anything, so that trades which would fail the balance check
+# in register_transaction can be dropped before they are registered.
+#
+# The trades are applied in order to an overlay of the balance sheet: the
+# verifier's ledger is never modified, and each trade that can be afforded
+# spends its debits in the overlay, as register_transaction would, so that
+# later trades see the balances left by the earlier ones. With
+# assume_confirmed, the credits are received straight away too, as if every
+# trade were confirmed as soon as it was registered.
+#
+# usage: simulate [--assume-confirmed] dir_or_jsonl [results.jsonl]
+#
+# verifies the chain in the current directory (from the last checkpoint),
+# simulates a batch of trades (see trades.py) and writes one line of JSON for
+# each trade.
+
+
+class Simulation:
+    def __init__(self, v, assume_confirmed=False):
+        self.ledger = v.ledger
+        self.fpr = v.fpr
+        self.assume_confirmed = assume_confirmed
+        self.reset()
+
+    # Forget the effect of the trades simulated so far.
+    def reset(self):
+        # balance changes by ledger id
+        self.overlay = {}
+        # ids of the currencies that aren't in the ledger yet
+        self.new_ids = {}
+
+    def id(self, fpr):
+        i = self.ledger.ids.get(fpr)
+        if i is None:
+            i = self.new_ids.get(fpr)
+            if i is None:
+                i = len(self.ledger.fprs) + len(self.new_ids)
+                self.new_ids[fpr] = i
+        return i
+
+    def balance(self, i):
+        balances = self.ledger.balances
+        base = balances[i] if i < len(balances) else None
+        return (base or 0) + self.overlay.get(i, 0)
+
+    # Simulate the trade for the participant in column i. Returns a list of
+    # (fpr, current balance, value) for every debit that can't be afforded, by
+    # the same rule as the verifier (see Ledger.shortfalls). The trade only
+    # changes the overlay if the list is empty.
+    def apply(self, trade_matrix, i):
+        if isinstance(trade_matrix, TradeMatrix):
+            n = trade_matrix.num_participants
+            column = zip(trade_matrix.fprs, trade_matrix.values[i::n])
+        else:
+            column = ((fpr, values[i]) for fpr, values in trade_matrix.items())
+        debit_ids = []
+        debit_values = []
+        credits = []
+        for fpr, value in column:
+            # The values of a TradeMatrix are NumPy or array ints.
+            value = int(value)
+            if value < 0:
+                debit_ids.append(self.id(fpr))
+                debit_values.append(value)
+            elif value > 0:
+                credits.append((self.id(fpr), value))
+        shortfalls = self.ledger.shortfalls(
+            debit_ids, debit_values, self.id(self.fpr), self.balance)
+        if shortfalls:
+            fprs = self.ledger.fprs + list(self.new_ids)
+            return [(fprs[j], current_balance, value)
+                    for j, current_balance, value in shortfalls]
+        overlay = self.overlay
+        for j, value in zip(debit_ids, debit_values):
+            overlay[j] = overlay.get(j, 0) + value
+        if self.assume_confirmed:
+            for j, value in credits:
+                overlay[j] = overlay.get(j, 0) + value
+        return shortfalls
+
+    # Simulate a batch of trades, as (rootdirs, trade_matrix), for the
+    # participant with the chain in rootdir. Yields one result per trade.
+    def simulate_trades(self, rootdir, trades):
+        rootdir = pathlib.Path(rootdir).resolve()
+        for n, (rootdirs, trade_matrix) in enumerate(trades):
+            result = {'trade': n}
+            if rootdir not in rootdirs:
+                result['status'] = 'not_participant'
+                yield result
+                continue
+            if not isinstance(trade_matrix, TradeMatrix):
+                try:
+                    check_trade_matrix(len(rootdirs), trade_matrix)
+                except Exception as e:
+                    result['status'] = 'invalid'
+                    result['error'] = str(e)
+                    yield result
+                    continue
+            shortfalls = self.apply(trade_matrix, rootdirs.index(rootdir))
+            if shortfalls:
+                result['status'] = 'unaffordable'
+                result['shortfalls'] = [
+                    {'fpr': fpr, 'balance': current_balance, 'spend': -value,
+                     'short_by': -(current_balance + value)}
+                    for fpr, current_balance, value in shortfalls]
+            else:
+                result['status'] = 'ok'
+            yield result
+
+    # The balances after the simulated trades, for the currencies they changed.
+    def balance_sheet_changes(self):
+        fprs = self.ledger.fprs + list(self.new_ids)
+        return {fprs[i]: self.balance(i) for i in self.overlay}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='simulate')
+    parser.add_argument('--assume-confirmed', action='store_true',
+                        help='receive the credits of each trade straight away')
+    parser.add_argument('trades', help='directory of trade files or JSON Lines file')
+    parser.add_argument('results', nargs='?', help='write the results here (default: stdout)')
+    args = parser.parse_args()
+    from .verifier import verify_chain
+    rootdir = pathlib.Path.cwd()
+    simulation = Simulation(verify_chain(rootdir), args.assume_confirmed)
+    trades = read_trade_batch(args.trades)
+    f = sys.stdout if args.results is None else open(args.results, 'w')
+    failed = 0
+    for result in simulation.simulate_trades(rootdir, trades):
+        if result['status'] != 'ok':
+            failed += 1
+        f.write(json.dumps(result) + '\n')
+    if f is not sys.stdout:
+        f.close()
+    print(f'{failed} of {len(trades)} trades would fail', file=sys.stderr)
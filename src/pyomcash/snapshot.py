@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import base64
+import collections
+import gpg
+import json
+import pathlib
+import sys
+from pyomcore.utils import *
+from pyomcore.verifier import TransactionStatus, check_blockchain_dir
+from .checkpoint import block_hash, checkpoint_state, contract_version, save_checkpoint
+from .ledger import Ledger
+from .verifier import CashVerifier, verify_chain
+
+# A snapshot is a signed copy of the verified state of a chain, so that a new
+# node can start from it instead of verifying the whole chain. It's a JSON
+# file with the block height and block hash it was taken at, the balance
+# sheet, the set of authors and the state of every pyomcash transaction, and
+# the complete verifier state, which the core verifier needs to carry on from
+# that height. The signature is in a detached file, snapshot.json.sig.
+#
+# A snapshot comes from another machine, so the verifier state in it is plain
+# JSON data, never a pickle: decoding it can only create JSON values, the
+# containers below and the classes in state_classes. Values that JSON can't
+# represent are tagged as {"$": type, "value": ...}. Encoding fails on any
+# other type, rather than guess how to rebuild it. The view cache isn't
+# exported; the importer rebuilds the views as it needs them.
+#
+# Importing checks the signature against a trusted key before anything in the
+# file is used, and checks that the block at the snapshot height is the same
+# in the local chain. The snapshot is then saved as a checkpoint, so the next
+# run of the verifier only verifies the blocks after it.
+#
+# usage: snapshot export snapshot.json [--key FPR] [--gpg-home DIR]
+#        snapshot import snapshot.json --trust FPR [--gpg-home DIR]
+
+snapshot_format = 'pyomcash-snapshot-2'
+
+# The classes that may appear in the verifier state, by name.
+state_classes = {'Ledger': Ledger, 'TransactionStatus': TransactionStatus}
+
+# Verifier attributes that aren't exported: the importer's own rootdir is
+# used, and the views are rebuilt.
+local_attrs = ('rootdir', 'cash_views')
+
+
+def signature_path(path):
+    return pathlib.Path(path).with_name(pathlib.Path(path).name + '.sig')
+
+
+
+def encode_value(x):
+    if x is None or type(x) in (bool, int, float, str):
+        return x
+    if type(x) is list:
+        return [encode_value(y) for y in x]
+    if type(x) is dict:
+        if '$' not in x and all(type(key) is str for key in x):
+            return {key: encode_value(y) for key, y in x.items()}
+        return {'$': 'dict', 'value': [[encode_value(key), encode_value(y)]
+                                       for key, y in x.items()]}
+    if type(x) in (tuple, set, frozenset):
+        return {'$': type(x).__name__, 'value': [encode_value(y) for y in x]}
+    if isinstance(x, pathlib.PurePath):
+        return {'$': 'path', 'value': x.as_posix()}
+    if type(x) is bytes:
+        return {'$': 'bytes', 'value': base64.b64encode(x).decode()}
+    if state_classes.get(type(x).__name__) is type(x):
+        return {'$': type(x).__name__, 'value': encode_value(vars(x))}
+    raise Exception(f'cannot put a {type(x).__name__} in a snapshot')
+
+
+def decode_value(x):
+    if type(x) is list:
+        return [decode_value(y) for y in x]
+    if type(x) is not dict:
+        return x
+    if '$' not in x:
+        return {key: decode_value(y) for key, y in x.items()}
+    t = x['$']
+    value = x.get('value')
+    if t == 'dict':
+        return {decode_value(key): decode_value(y) for key, y in value}
+    if t == 'tuple':
+        return tuple(decode_value(y) for y in value)
+    if t == 'set':
+        return set(decode_value(y) for y in value)
+    if t == 'frozenset':
+        return frozenset(decode_value(y) for y in value)
+    if t == 'path':
+        return pathlib.Path(value)
+    if t == 'bytes':
+        return base64.b64decode(value)
+    if t in state_classes:
+        attrs = decode_value(value)
+        if type(attrs) is not dict or not all(type(key) is str for key in attrs):
+            raise Exception(f'bad {t} in snapshot')
+        obj = state_classes[t].__new__(state_classes[t])
+        obj.__dict__.update(attrs)
+        return obj
+    raise Exception(f'unknown type in snapshot: {t}')
+
+# The snapshot of verifier v, which has verified blocks 0..idx, as bytes.
+
+
+def make_snapshot(v, idx):
+    state = checkpoint_state(v)
+    for attr in local_attrs:
+        del state[attr]
+    snapshot = {
+        'format': snapshot_format,
+        'version': contract_version(),
+        'fpr': v.fpr,
+        'idx': idx,
+        'block_hash': block_hash(v.rootdir, idx),
+        'balance_sheet': v.balance_sheet,
+        'author_fprs': sorted(v.author_fprs),
+        'transaction_states': v.transaction_states,
+        'state': encode_value(state)
+    }
+    return json.dumps(snapshot, indent=1).encode()
+
+# Sign data with the key fpr. Returns the detached, ASCII-armored signature.
+
+
+def sign_snapshot(gpg_ctx, fpr, data):
+    gpg_ctx.armor = True
+    gpg_ctx.signers = [gpg_ctx.get_key(fpr, secret=True)]
+    signature, result = gpg_ctx.sign(data, mode=gpg.constants.sig.mode.DETACH)
+    return signature
+
+# Raises an exception unless data has a good signature by the key
+# trusted_fpr, which must be in the keyring of gpg_ctx.
+
+
+def check_signature(gpg_ctx, data, signature, trusted_fpr):
+    try:
+        key = gpg_ctx.get_key(trusted_fpr)
+    except (gpg.errors.KeyNotFound, gpg.errors.GPGMEError):
+        raise Exception(f'trusted key {trusted_fpr} is not in the keyring')
+    fprs = set(subkey.fpr for subkey in key.subkeys)
+    try:
+        _, result = gpg_ctx.verify(data, signature=signature)
+    except gpg.errors.BadSignatures as e:
+        raise Exception(f'bad snapshot signature: {e}')
+    if not any(s.fpr in fprs for s in result.signatures):
+        raise Exception(f'snapshot is not signed by {trusted_fpr}')
+
+
+def export_snapshot(rootdir, path, gpg_ctx, fpr=None):
+    numblocks = check_blockchain_dir(rootdir)
+    v = verify_chain(rootdir, numblocks=numblocks)
+    idx = numblocks - 1
+    data = make_snapshot(v, idx)
+    signature = sign_snapshot(gpg_ctx, v.fpr if fpr is None else fpr, data)
+    pathlib.Path(path).write_bytes(data)
+    signature_path(path).write_bytes(signature)
+    return idx
+
+# Check the snapshot at path and save it as a checkpoint of the chain in
+# rootdir. Returns the block height of the snapshot.
+
+
+def import_snapshot(rootdir, path, gpg_ctx, trusted_fpr):
+    data = pathlib.Path(path).read_bytes()
+    check_signature(gpg_ctx, data,
+                    signature_path(path).read_bytes(), trusted_fpr)
+    snapshot = json.loads(data)
+    if snapshot.get('format') != snapshot_format:
+        raise Exception('not a pyomcash snapshot: ' + str(path))
+    if snapshot['version'] != contract_version():
+        raise Exception(
+            f'snapshot was made by pyomcash {snapshot["version"]}, not {contract_version()}')
+    idx = snapshot['idx']
+    numblocks = check_blockchain_dir(rootdir)
+    if idx >= numblocks:
+        raise Exception(
+            f'snapshot is at block {idx}, but the chain only has {numblocks} blocks')
+    if block_hash(rootdir, idx) != snapshot['block_hash']:
+        raise Exception(f'block {idx} of the chain does not match the snapshot')
+    state = decode_value(snapshot['state'])
+    if type(state) is not dict or any(attr in state for attr in local_attrs):
+        raise Exception('bad verifier state in snapshot')
+    state['cash_views'] = collections.OrderedDict()
+    v = CashVerifier.from_state(
+        rootdir, init_local_gpg(rootdir.joinpath(gnupg_dirname)), state)
+    if (v.fpr != snapshot['fpr'] or
+            v.balance_sheet != snapshot['balance_sheet'] or
+            sorted(v.author_fprs) != snapshot['author_fprs'] or
+            v.transaction_states != snapshot['transaction_states']):
+        raise Exception('snapshot state does not match its summary')
+    save_checkpoint(v, idx)
+    return idx
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='snapshot')
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('path', help='the snapshot file')
+    parser.add_argument('--key', metavar='FPR',
+                        help='export: sign with this key (default: the chain owner\'s)')
+    parser.add_argument('--trust', metavar='FPR',
+                        help='import: the key the snapshot must be signed by')
+    parser.add_argument('--gpg-home', metavar='DIR',
+                        help='gpg homedir (default: ~/.gnupg)')
+    args = parser.parse_args()
+    rootdir = pathlib.Path.cwd()
+    if args.gpg_home is None:
+        gpg_ctx = gpg.Context()
+    else:
+        gpg_ctx = gpg.Context(home_dir=args.gpg_home)
+    if args.command == 'export':
+        idx = export_snapshot(rootdir, args.path, gpg_ctx, args.key)
+        print(f'Exported snapshot at block {idx}')
+    else:
+        if args.trust is None:
+            parser.error('import needs --trust FPR')
+        idx = import_snapshot(rootdir, args.path, gpg_ctx, args.trust)
+        print(f'Imported snapshot at block {idx}')
+        v = verify_chain(rootdir)
+        sys.stdout.writelines(v.print_balance_sheet())
@@ -0,0 +1,110 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import json
+import os
+import resource
+import sys
+import time
+
+# Per-phase timers and counters for verify_chain(rootdir, stats=...). The
+# phases are:
+#
+#   core_verify        pyomcore's checks of the block, including gpg
+#   read_block         loading blocks whose core copy couldn't be captured
+#   transaction_lookup finding the transactions touched by each block
+#   block_processors   all the block processors, including the cash replay
+#   validate           checking trade matrices (once per transaction)
+#   balance_update     applying actions to the balance sheet
+#   checkpoint_load, checkpoint_save
+#
+# block_processors includes validate and balance_update. The counters are
+# blocks, actions.<action type>, trade_matrix_cells_validated,
+# trade_matrix_cells_applied, and bytes_read.core_verify and
+# bytes_read.read_block: the bytes this process read during those two phases,
+# from the kernel's count of the process's reads (Linux only). Loading the
+# blocks is most of it, but bytes_read.core_verify also includes what gpg
+# sends back.
+#
+# callback, if given, is called as callback(idx, stats) after every block, for
+# exporting the metrics while the verifier is running.
+
+
+class VerifierStats:
+    def __init__(self, callback=None):
+        self.seconds = collections.defaultdict(float)
+        self.counters = collections.Counter()
+        self.callback = callback
+
+    def add_time(self, phase, start):
+        self.seconds[phase] += time.perf_counter() - start
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def block_done(self, idx):
+        self.counters['blocks'] += 1
+        if self.callback is not None:
+            self.callback(idx, self)
+
+    def as_dict(self):
+        return {
+            'seconds': dict(self.seconds),
+            'counters': dict(self.counters)
+        }
+
+    def dump(self, f):
+        json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+        f.write('\n')
+
+# Resident set size of this process in bytes, or None where it can't be read.
+# The peak RSS from getrusage is no substitute: it never goes down.
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+# Number of bytes this process has read so far, or None where it can't be
+# read. Reading the count is itself a read: with include_this_read, the
+# result includes it, so the bytes read between bytes_read() and a later
+# bytes_read(include_this_read=False) are exactly what was read in between.
+
+
+def bytes_read(include_this_read=True):
+    try:
+        with open('/proc/self/io', 'rb') as f:
+            data = f.read()
+        for line in data.splitlines():
+            if line.startswith(b'rchar:'):
+                return int(line.split()[1]) + (len(data) if include_this_read else 0)
+    except (OSError, ValueError):
+        pass
+    return None
+
+# Peak resident set size of this process in bytes. getrusage reports it in
+# kilobytes, except on macOS, where it's in bytes.
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
@@ -0,0 +1,195 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+import array
+import csv
+import json
+import pathlib
+from .validation import nonzero_rows
+
+# Readers for the trade files accepted by propose_trade. Each reader returns
+# (rootdirs, trade_matrix), where rootdirs is a list of resolved paths.
+#
+# A trade CSV file looks like this:
+#
+# ,user0/pyom/,user1/pyom/,user2/pyom/,user3/pyom/
+# 96184222620D63E9F0EE9D092A5D1800F9270BD8,-3,1,1,1
+# 34494EA12F87A474B5028BC9D1C968A30BB32446,2,-6,2,2
+# 5DDC3FDE29D8C7763E076FE3DA5FBBE24247EC55,3,3,-9,3
+# 2B92F7405A555697A0F401CCCAC5100A0CB0FEC7,4,4,4,-12
+#
+# The first row is a list of pyom directories, with the current user in column 1.
+# Then there's one row for each currency, with the gpg fingerprint of the currency
+# in column 0 and a value for each user in the other columns. The values in each
+# row should sum to zero.
+#
+# Large trade matrices can also be supplied as a NumPy .npz file (this needs
+# NumPy to be installed), with three arrays: rootdirs (strings), fprs (strings)
+# and values (a 2-dimensional int64 array with one row per fingerprint).
+#
+# A batch of trades is either a directory of trade files, or a JSON Lines
+# file with one trade per line:
+#
+# {"rootdirs": ["user0/pyom/", "user1/pyom/"], "trade_matrix": {"9618...0BD8": [-3, 3]}}
+
+# Compact trade matrix: the fingerprints and a flat, row-major array of int64
+# values, which is much smaller than a dict of lists of Python ints. The rows
+# have already been checked by the reader that created it.
+
+
+class TradeMatrix:
+    def __init__(self, num_participants, fprs, values):
+        self.num_participants = num_participants
+        self.fprs = fprs
+        self.values = values
+
+    def __len__(self):
+        return len(self.fprs)
+
+    def row(self, k):
+        n = self.num_participants
+        return self.values[k*n:(k+1)*n].tolist()
+
+    def items(self):
+        for k, fpr in enumerate(self.fprs):
+            yield fpr, self.row(k)
+
+    # The dict of lists that goes into the transaction.
+    def to_dict(self):
+        return dict(self.items())
+
+# Collects the bad rows of a trade matrix, so that they can all be reported at
+# once.
+
+
+class TradeMatrixErrors:
+    def __init__(self, path):
+        self.path = path
+        self.errors = []
+
+    def add(self, lineno, message):
+        self.errors.append(f'{self.path}:{lineno}: {message}')
+
+    def check(self):
+        if self.errors:
+            raise Exception(f'{len(self.errors)} bad rows in trade matrix:\n' +
+                            '\n'.join(self.errors))
+
+
+def resolve_rootdirs(paths):
+    return list(map(lambda p: pathlib.Path(p).resolve(), paths))
+
+
+# Rows are checked as they are read, and every bad row is reported.
+
+
+def read_trade_csv(path):
+    errors = TradeMatrixErrors(path)
+    with open(path, mode='r', newline='') as f:
+        reader = csv.reader(f, skipinitialspace=True)
+        firstrow = next(reader)
+        n = len(firstrow)
+        if n < 2:
+            raise Exception('csv file should have at least 2 columns')
+        if firstrow[0] != '':
+            raise Exception('first cell of first row should be empty')
+        rootdirs = resolve_rootdirs(firstrow[1:])
+        fprs = []
+        seen = set()
+        values = array.array('q')
+        for row in reader:
+            if len(row) != n:
+                errors.add(reader.line_num,
+                           f'row is length {len(row)} but expected {n}: {row}')
+                continue
+            fpr = row[0]
+            if fpr in seen:
+                errors.add(reader.line_num, f'duplicate currency {fpr}')
+                continue
+            try:
+                rowvalues = array.array('q', map(int, row[1:]))
+            except ValueError as e:
+                errors.add(reader.line_num, f'bad value: {e}')
+                continue
+            except OverflowError:
+                errors.add(reader.line_num, f'value out of int64 range: {row}')
+                continue
+            total = sum(rowvalues)
+            if total != 0:
+                errors.add(reader.line_num, f'row sums to {total}, not 0')
+                continue
+            seen.add(fpr)
+            fprs.append(fpr)
+            values.extend(rowvalues)
+    errors.check()
+    return rootdirs, TradeMatrix(n - 1, fprs, values)
+
+
+def read_trade_npz(path):
+    try:
+        import numpy as np
+    except ImportError:
+        raise Exception(f'NumPy is needed to read {path}')
+    with np.load(path, allow_pickle=False) as data:
+        rootdirs = resolve_rootdirs(data['rootdirs'].tolist())
+        fprs = data['fprs'].tolist()
+        values = data['values'].astype(np.int64, casting='safe')
+    if values.shape != (len(fprs), len(rootdirs)):
+        raise Exception(
+            f'{path}: values has shape {values.shape} but expected {(len(fprs), len(rootdirs))}')
+    errors = TradeMatrixErrors(path)
+    for k in nonzero_rows(values):
+        errors.add(f'row {k}', f'row sums to {values[k].sum(dtype=object)}, not 0')
+    seen = set()
+    for k, fpr in enumerate(fprs):
+        if fpr in seen:
+            errors.add(f'row {k}', f'duplicate currency {fpr}')
+        seen.add(fpr)
+    errors.check()
+    return rootdirs, TradeMatrix(len(rootdirs), fprs, values.ravel())
+
+
+def read_trade_file(path):
+    if pathlib.Path(path).suffix == '.npz':
+        return read_trade_npz(path)
+    return read_trade_csv(path)
+
+
+def read_trade_jsonl(path):
+    trades = []
+    with open(path, mode='r') as f:
+        for lineno, line in enumerate(f, 1):
+            if line.strip() == '':
+                continue
+            try:
+                trade = json.loads(line)
+                trades.append((resolve_rootdirs(trade['rootdirs']),
+                               trade['trade_matrix']))
+            except (ValueError, KeyError, TypeError) as e:
+                raise Exception(f'{path}:{lineno}: bad trade: {e}')
+    return trades
+
+# Read a batch of trades from a directory of trade files (in filename order) or
+# from a JSON Lines file.
+
+
+def read_trade_batch(path):
+    path = pathlib.Path(path)
+    if path.is_dir():
+        paths = sorted(p for p in path.iterdir()
+                       if p.suffix == '.csv' or p.suffix == '.npz')
+        return [read_trade_file(p) for p in paths]
+    return read_trade_jsonl(path)
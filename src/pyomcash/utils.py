@@ -14,9 +14,13 @@
 # You should have received a copy of the GNU General Public License
 # along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
 
+import hashlib
 import pathlib
-from pyomcore.verifier import verify_chain
 from pyomcore.utils import *
+from pyomcore.verifier import verify_chain
+from .cache import cache_dir, cache_dir_envvar, load_author_keys, save_author_key
+from .trades import TradeMatrix
+from .validation import check_trade_matrix
 
 default_contract_subdir = smart_contracts_dirname.joinpath('pyomcash')
 
@@ -32,35 +36,25 @@ def init_participant(rootdir):
     }
 
 # Get the fpr of the author of this smart contract. Not hardcoded to make testing easier.
+# The key is imported into the gpg homedir of rootdir the first time, and its
+# fpr is cached by the hash of the key file, so later calls don't need gpg.
 
 
 def get_author_fpr(rootdir):
-    v = verify_chain(rootdir)
     contract_dir = rootdir.joinpath(default_contract_subdir)
     author_keypath = contract_dir.joinpath(smartcontract_pubkey_filename)
-    return import_key(v.gpg_ctx, author_keypath.read_bytes())
-
-# Check that the trade_matrix is zero-sum.
-
-
-def check_trade_matrix(num_participants, trade_matrix):
-    for fpr, values in trade_matrix.items():
-        if len(values) != num_participants:
-            raise Exception(f'Row is not length {n}: {values}')
-        total = 0
-        for value in values:
-            if not isinstance(value, int):
-                raise Exception(f'value is not an int: {value}')
-            total += value
-        if total != 0:
-            raise Exception(f'Non-zero sum: sum({values}) == {sum(values)}')
+    key = author_keypath.read_bytes()
+    key_hash = hashlib.sha512(key).hexdigest()
+    fpr = load_author_keys(rootdir).get(key_hash)
+    if fpr is None:
+        gpg_ctx = init_local_gpg(rootdir.joinpath(gnupg_dirname))
+        fpr = import_key(gpg_ctx, key)
+        save_author_key(rootdir, key_hash, fpr)
+    return fpr
 
 
-def create_trade(expiry_delta, rootdirs, trade_matrix):
-    num_participants = len(rootdirs)
-    check_trade_matrix(num_participants, trade_matrix)
-    author_fpr = get_author_fpr(rootdirs[0])
-    transaction_init = {
+def pyomcash_transaction_init(author_fpr, trade_matrix):
+    return {
         'numlocations': 1,
         'contracts': [
             {
@@ -71,5 +65,100 @@ def create_trade(expiry_delta, rootdirs, trade_matrix):
             }
         ]
     }
+
+
+# Check a trade matrix and return it in the form that goes into the
+# transaction. A TradeMatrix has already been checked when it was read.
+
+
+def prepare_trade_matrix(num_participants, trade_matrix):
+    if isinstance(trade_matrix, TradeMatrix):
+        if trade_matrix.num_participants != num_participants:
+            raise Exception(
+                f'trade matrix has {trade_matrix.num_participants} columns but there are {num_participants} participants')
+        return trade_matrix.to_dict()
+    check_trade_matrix(num_participants, trade_matrix)
+    return trade_matrix
+
+
+def create_trade(expiry_delta, rootdirs, trade_matrix):
+    trade_matrix = prepare_trade_matrix(len(rootdirs), trade_matrix)
+    # The proposer's chain must be valid before anything is added to it.
+    verify_chain(rootdirs[0])
+    author_fpr = get_author_fpr(rootdirs[0])
+    transaction_init = pyomcash_transaction_init(author_fpr, trade_matrix)
     participants = list(map(init_participant, rootdirs))
     return create_transaction(participants, expiry_delta, transaction_init)
+
+# Merge the protoblocks for one participant into a single protoblock, so that
+# all the transactions can be registered in one block.
+
+
+def combine_protoblocks(protoblocks):
+    combined = {'actions': []}
+    for protoblock in protoblocks:
+        for key, value in protoblock.items():
+            if key == 'actions':
+                combined['actions'].extend(value)
+            elif key not in combined:
+                combined[key] = value
+            elif combined[key] != value:
+                raise Exception(f'cannot combine protoblocks: conflicting {key}')
+    return combined
+
+# Create many trades in one pass. trades is a list of (rootdirs, trade_matrix)
+# pairs, as accepted by create_trade. All the trade matrices are checked before
+# anything else is done. Then the chain of each distinct proposer (the
+# participant in column 1) is verified once, and the author key is resolved
+# once per proposer. Returns the list of protoblocks of each trade, as
+# returned by create_trade.
+
+
+def create_trade_protoblocks(expiry_delta, trades):
+    if len(trades) == 0:
+        raise Exception('no trades')
+    prepared = []
+    for n, (rootdirs, trade_matrix) in enumerate(trades):
+        try:
+            prepared.append(
+                (rootdirs, prepare_trade_matrix(len(rootdirs), trade_matrix)))
+        except Exception as e:
+            raise Exception(f'trade {n}: {e}')
+    author_fprs = {}
+    for rootdirs, trade_matrix in prepared:
+        if rootdirs[0] not in author_fprs:
+            verify_chain(rootdirs[0])
+            author_fprs[rootdirs[0]] = get_author_fpr(rootdirs[0])
+    result = []
+    for rootdirs, trade_matrix in prepared:
+        transaction_init = pyomcash_transaction_init(
+            author_fprs[rootdirs[0]], trade_matrix)
+        participants = list(map(init_participant, rootdirs))
+        result.append(create_transaction(
+            participants, expiry_delta, transaction_init))
+    return result
+
+# Group the protoblocks of many trades by participant. Returns a dict which
+# maps each rootdir to one protoblock that registers all the trades it takes
+# part in.
+
+
+def combine_trade_protoblocks(trades, trade_protoblocks):
+    protoblocks = {}
+    for (rootdirs, trade_matrix), blocks in zip(trades, trade_protoblocks):
+        for rootdir, protoblock in zip(rootdirs, blocks):
+            protoblocks.setdefault(rootdir, []).append(protoblock)
+    return {rootdir: combine_protoblocks(blocks) for rootdir, blocks in protoblocks.items()}
+
+# Like create_trade_protoblocks, but returns one combined protoblock per
+# participant.
+
+
+def create_trades(expiry_delta, trades):
+    return combine_trade_protoblocks(trades, create_trade_protoblocks(expiry_delta, trades))
+
+# The hash of the transaction registered by the protoblocks of a trade.
+
+
+def trade_transaction_hash(protoblocks):
+    return protoblocks[0]['actions'][-1]['transaction']['SHA-512']
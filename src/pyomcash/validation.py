@@ -0,0 +1,105 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+import itertools
+
+# Checks for trade matrices. Large matrices are checked with NumPy, if it is
+# installed, in a single pass over the whole matrix. If that finds a problem,
+# or NumPy isn't available, the matrix is checked row by row in pure Python,
+# which also produces the error messages. Both paths only accept plain Python
+# ints as values (see is_int), so the result never depends on the size of the
+# matrix.
+
+int64_min = -2**63
+int64_max = 2**63 - 1
+
+# Matrices with fewer cells than this are not worth converting to NumPy.
+numpy_min_cells = 4096
+
+_numpy = None
+
+
+def numpy():
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+# Row indices of a 2-dimensional int64 array whose rows don't sum to zero. The
+# sums are computed exactly, without int64 overflow, by adding up the high and
+# low 32 bits of the values separately: the row sum is hi * 2**32 + lo, with
+# 0 <= lo < num_columns * 2**32.
+
+
+def nonzero_rows(values):
+    np = numpy()
+    hi = (values >> 32).sum(axis=1)
+    lo = (values & 0xFFFFFFFF).sum(axis=1)
+    return np.flatnonzero(((lo & 0xFFFFFFFF) != 0) | ((lo >> 32) != -hi))
+
+
+# Only plain Python ints are valid values: a NumPy integer would be accepted
+# by np.array, but can't be written to JSON by create_transaction, and a bool
+# isn't a number of anything.
+
+
+def is_int(value):
+    return type(value) is int
+
+
+def numpy_check(num_participants, trade_matrix):
+    np = numpy()
+    if set(map(type, itertools.chain.from_iterable(trade_matrix.values()))) != {int}:
+        return False
+    values = np.array(list(trade_matrix.values()))
+    if values.dtype.kind != 'i' or values.dtype.itemsize != 8:
+        return False
+    return len(nonzero_rows(values)) == 0
+
+
+def row_errors(num_participants, fpr, values):
+    if len(values) != num_participants:
+        return [f'{fpr}: row is length {len(values)} but expected {num_participants}: {values}']
+    errors = []
+    for value in values:
+        if not is_int(value):
+            errors.append(f'{fpr}: value is not an int: {value}')
+        elif value < int64_min or value > int64_max:
+            errors.append(f'{fpr}: value is out of int64 range: {value}')
+    if not errors and sum(values) != 0:
+        errors.append(f'{fpr}: non-zero sum: sum({values}) == {sum(values)}')
+    return errors
+
+# Check that the trade_matrix is zero-sum: every row has one int64 value per
+# participant and sums to zero. All the offending rows are listed in the
+# exception.
+
+
+def check_trade_matrix(num_participants, trade_matrix):
+    if (len(trade_matrix) * num_participants >= numpy_min_cells and numpy() is not None and
+            all(len(values) == num_participants for values in trade_matrix.values()) and
+            numpy_check(num_participants, trade_matrix)):
+        return
+    errors = []
+    for fpr, values in trade_matrix.items():
+        errors.extend(row_errors(num_participants, fpr, values))
+    if errors:
+        raise Exception(f'{len(errors)} errors in trade matrix:\n' +
+                        '\n'.join(errors))
@@ -16,112 +16,517 @@
 # You should have received a copy of the GNU General Public License
 # along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
 
+import argparse
+import collections
+import pathlib
 import sys
+import threading
+import time
+import pyomcore.verifier
 from pyomcore.utils import *
 from pyomcore.verifier import Verifier, check_blockchain_dir
 from .utils import *
+from .ledger import Ledger, CashView
+from .checkpoint import load_checkpoint, save_checkpoint
+from .balance_index import open_balance_index
+from .balance_output import formats, write_balances
+from .stats import VerifierStats, bytes_read, rss_bytes
+from .view_store import open_cash_view_store
+
+
+transaction_action_types = frozenset([
+    'register_transaction',
+    'confirm_transaction',
+    'cancel_transaction',
+    'annul_transaction',
+    'reinstate_transaction'
+])
+
+# After these actions the transaction can no longer change state, so its
+# CashView is dropped from the cache.
+final_action_types = frozenset(['cancel_transaction'])
+
+# Maximum number of CashViews to keep. Evicted views are rebuilt if the
+# transaction is used again.
+max_cached_views = 10000
+
+# The memory budget of streaming mode only shrinks the view cache while it
+# holds at least this many views; below that it wouldn't free anything worth
+# having.
+min_budget_views = 1000
+
+# Fraction of the memory budget by which the resident size has to grow again
+# before the view cache is shrunk a second time, and by which it has to fall
+# below the budget before the cache is allowed to grow back.
+memory_margin = 0.1
+
+# The core verifier loads and parses every block itself, with the load_block
+# in its own module. That load_block is wrapped once, here, so that
+# CashVerifier.verify_core can keep the block the core verifier parsed and the
+# block processors don't need to load it a second time. The wrapper only
+# records blocks while verify_core is running in the same thread, and if the
+# core verifier doesn't load the block through it, verify_block falls back to
+# loading the block itself.
+captured = threading.local()
+core_load_block = getattr(pyomcore.verifier, 'load_block', None)
+
+
+def capturing_load_block(rootdir, idx, *args, **kwargs):
+    block = core_load_block(rootdir, idx, *args, **kwargs)
+    blocks = getattr(captured, 'blocks', None)
+    if blocks is not None:
+        blocks[(pathlib.Path(rootdir), idx)] = block
+    return block
+
+
+if core_load_block is not None:
+    pyomcore.verifier.load_block = capturing_load_block
 
 
 class CashVerifier(Verifier):
+    # Attributes that belong to this process and are not saved in checkpoints.
+    transient_attrs = ('gpg_ctx', 'block_processors', 'block_deltas',
+                       'view_store', 'max_memory', 'view_limit', 'shrunk_at_rss')
+
     def __init__(self, rootdir, gpg_ctx):
         super().__init__(rootdir, gpg_ctx)
-        self.balance_sheet = {}
+        self.ledger = Ledger()
+        # CashViews of recently used transactions, by hash, least recently
+        # used first
+        self.cash_views = collections.OrderedDict()
+        # The most recent action on each pyomcash transaction, by hash
+        self.transaction_states = {}
         # viral signing policy: the set of authors can never shrink
         self.author_fprs = set()
+        self.init_block_processors()
+        self.init_view_cache()
+
+    # Recreate a verifier from the state saved by save_checkpoint.
+    @classmethod
+    def from_state(cls, rootdir, gpg_ctx, state):
+        v = cls.__new__(cls)
+        v.__dict__.update(state)
+        v.rootdir = rootdir
+        v.gpg_ctx = gpg_ctx
+        v.init_block_processors()
+        v.init_view_cache()
+        return v
+
+    # Block processors are called as f(v, idx, block, touched) for every block,
+    # after the block has passed the core verification. block is the parsed
+    # block and touched is a list of (action type, transaction hash,
+    # TransactionStatus) for the transaction actions in the block, so
+    # processors never need to load the block again.
+    def init_block_processors(self):
+        self.block_processors = [CashVerifier.process_block]
+        # If not None, the cash processor fills this with the balance changes
+        # of the current block, as (transaction hash, action type, changes)
+        # where changes is the return value of apply_trade_column.
+        self.block_deltas = None
+
+    def add_block_processor(self, f):
+        self.block_processors.append(f)
+
+    def init_view_cache(self):
+        # Where evicted views go in streaming mode
+        self.view_store = None
+        self.max_memory = None
+        self.view_limit = max_cached_views
+        # The resident size when the view cache was last shrunk
+        self.shrunk_at_rss = None
+
+    # Streaming mode, for chains with more transactions than fit in memory.
+    # The CashViews that are evicted from the cache are written to an on-disk
+    # CashViewStore, and read back from there if the transaction is used
+    # again, instead of being validated again. The core verifier's record of
+    # each cancelled pyomcash transaction is also cut down to its participants
+    # (see compact_finished). The records of the other transactions, and one
+    # entry per transaction in self.transaction_states, still stay in memory,
+    # so memory use still grows with the number of open and confirmed
+    # transactions, but no longer with the trades that have been cancelled.
+    #
+    # If max_memory is set, the view cache is shrunk to half its size when the
+    # resident size of the process goes over max_memory bytes. It isn't shrunk
+    # again until the process has grown by another memory_margin of the
+    # budget, because if shrinking didn't help, the memory is held by
+    # something else. Once the process is back under the budget, the cache
+    # grows back.
+    def enable_streaming(self, max_memory=None):
+        self.view_store = open_cash_view_store(self.rootdir)
+        if max_memory is not None:
+            if rss_bytes() is None:
+                print('Warning: the resident size of the process is unknown on this '
+                      'system, so the memory budget is ignored', file=sys.stderr)
+            else:
+                self.max_memory = max_memory
+                self.add_block_processor(CashVerifier.check_memory)
+
+    def check_memory(self, idx, block, touched):
+        rss = rss_bytes()
+        margin = memory_margin * self.max_memory
+        if rss > self.max_memory:
+            if (len(self.cash_views) >= min_budget_views and
+                    (self.shrunk_at_rss is None or rss > self.shrunk_at_rss + margin)):
+                self.view_limit = len(self.cash_views) // 2
+                self.evict_views()
+                self.shrunk_at_rss = rss
+        elif rss < self.max_memory - margin and self.view_limit < max_cached_views:
+            self.view_limit = min(2 * self.view_limit, max_cached_views)
+            self.shrunk_at_rss = None
 
     def verify_block(self, idx):
-        super().verify_block(idx)
-        block = load_block(self.rootdir, idx)
+        # The core verifier has already loaded and parsed the block, so it's
+        # only loaded again if that copy couldn't be captured.
+        block = self.verify_core(idx)
+        if block is None:
+            block = self.read_block(idx)
+        touched = self.touched_transactions(block)
+        self.run_block_processors(idx, block, touched)
+        if self.view_store is not None:
+            self.compact_finished(touched)
+
+    # Run the core verifier on block idx. Returns the block it parsed, or None
+    # if it wasn't captured.
+    def verify_core(self, idx):
+        captured.blocks = {}
+        try:
+            super().verify_block(idx)
+            return captured.blocks.get((pathlib.Path(self.rootdir), idx))
+        finally:
+            captured.blocks = None
+
+    def read_block(self, idx):
+        return load_block(self.rootdir, idx)
+
+    def touched_transactions(self, block):
+        touched = []
         for action in block['actions']:
             t = action['type']
-            if (t == 'register_transaction' or t == 'confirm_transaction' or
-                t == 'cancel_transaction' or t == 'annul_transaction' or
-                    t == 'reinstate_transaction'):
+            if t in transaction_action_types:
                 transaction_hash = action['transaction']['SHA-512']
-                transaction_status = self.transactions[transaction_hash]
-                self.process_transaction(t, transaction_status.transaction)
+                touched.append(
+                    (t, transaction_hash, self.transactions[transaction_hash]))
+        return touched
 
-    def process_transaction(self, t, transaction):
-        num_participants = len(transaction['participants'])
-        fprs = list(map(lambda p: p['gpg'], transaction['participants']))
+    def run_block_processors(self, idx, block, touched):
+        for f in self.block_processors:
+            f(self, idx, block, touched)
+
+    def process_block(self, idx, block, touched):
+        if self.block_deltas is not None:
+            self.block_deltas.clear()
+        for t, transaction_hash, transaction_status in touched:
+            self.process_transaction(
+                t, transaction_status.transaction, transaction_hash)
+
+    # The validated view of each transaction is cached by transaction hash, so
+    # that the later actions on the same transaction don't need to check it
+    # again. Only the viral signing policy is checked every time, because
+    # self.author_fprs can grow in the meantime.
+    def process_transaction(self, t, transaction, transaction_hash=None):
+        view = None
+        if transaction_hash is not None:
+            view = self.cash_views.get(transaction_hash)
+        if view is None:
+            if transaction_hash is not None and self.view_store is not None:
+                view = self.view_store.get(transaction_hash, self.ledger)
+            if view is None:
+                view = self.validate_transaction(transaction)
+            if transaction_hash is not None:
+                self.cache_view(transaction_hash, view)
+        else:
+            self.cash_views.move_to_end(transaction_hash)
+        for authors, column in view.contracts:
+            # Check viral signing policy
+            if not self.author_fprs.issubset(authors):
+                raise Exception('missing authors: ' +
+                                str(self.author_fprs.difference(authors)))
+            self.author_fprs = set(authors)
+            changes = self.apply_trade_column(t, column)
+            if self.block_deltas is not None:
+                self.block_deltas.append((transaction_hash, t, changes))
+        if transaction_hash is not None and view.contracts:
+            self.transaction_states[transaction_hash] = t
+            if t in final_action_types:
+                self.cash_views.pop(transaction_hash, None)
+                if self.view_store is not None:
+                    self.view_store.discard(transaction_hash)
+
+    # Cut the core verifier's record of each pyomcash transaction that can no
+    # longer change state down to its participants, which is all that pyomcash
+    # reads from it afterwards (see multichain.py). This drops the trade
+    # matrices from memory. It relies on the core verifier rejecting any later
+    # action on the transaction from its status alone, without reading the
+    # transaction again.
+    def compact_finished(self, touched):
+        for t, transaction_hash, transaction_status in touched:
+            if t in final_action_types and transaction_hash in self.transaction_states:
+                participants = transaction_status.transaction['participants']
+                transaction_status.transaction = {
+                    'participants': [{'gpg': p['gpg']} for p in participants]
+                }
+
+    def cache_view(self, transaction_hash, view):
+        self.cash_views[transaction_hash] = view
+        self.evict_views()
+
+    # Evict the least recently used views until there are at most
+    # self.view_limit of them.
+    def evict_views(self):
+        while len(self.cash_views) > self.view_limit:
+            transaction_hash, view = self.cash_views.popitem(last=False)
+            if self.view_store is not None:
+                self.view_store.put(transaction_hash, view, self.ledger)
+
+    def pyomcash_contracts(self, transaction):
         for contract in transaction['contracts']:
             if contract['uuid_hash']['SHA-512'] == pyomcash_uuid_hash:
-                # Check viral signing policy
-                authors = set(
-                    map(lambda author: author['gpg'], contract['authors']))
-                if not self.author_fprs.issubset(authors):
-                    raise Exception('missing authors: ' +
-                                    str(self.author_fprs.difference(authors)))
-                self.author_fprs = authors
-                trade_matrix = contract['trade_matrix']
-                check_trade_matrix(num_participants, trade_matrix)
-                self.update_balance_sheet(t, fprs, trade_matrix)
+                yield contract
+
+    # Check the pyomcash contracts of a transaction and build its CashView.
+    def validate_transaction(self, transaction):
+        num_participants = len(transaction['participants'])
+        fprs = list(map(lambda p: p['gpg'], transaction['participants']))
+        contracts = []
+        i = None
+        for contract in self.pyomcash_contracts(transaction):
+            if i is None:
+                i = fprs.index(self.fpr)
+            authors = frozenset(
+                map(lambda author: author['gpg'], contract['authors']))
+            trade_matrix = contract['trade_matrix']
+            check_trade_matrix(num_participants, trade_matrix)
+            contracts.append(
+                (authors, self.ledger.compile_column(trade_matrix, i)))
+        return CashView(i, tuple(contracts))
+
+    @property
+    def balance_sheet(self):
+        return self.ledger.as_dict()
 
     def update_balance_sheet(self, t, fprs, trade_matrix):
         i = fprs.index(self.fpr)
+        self.apply_trade_column(t, self.ledger.compile_column(trade_matrix, i))
+
+    # The debits of a transaction that this verifier can't afford, as
+    # (fpr, current balance, total value) tuples, with the debits of all its
+    # pyomcash contracts added up per currency. view is a CashView or a single
+    # TradeColumn.
+    def unaffordable(self, view):
+        if isinstance(view, CashView):
+            columns = [column for authors, column in view.contracts]
+        else:
+            columns = [view]
+        own_id = self.ledger.ids.get(self.fpr)
+        return [(self.ledger.fprs[i], current_balance, value)
+                for i, current_balance, value in self.ledger.columns_shortfalls(columns, own_id)]
+
+    # Returns the change to the balances as (ids, values, sign): the balance
+    # of currency ids[k] changed by sign * values[k].
+    def apply_trade_column(self, t, column):
         if t == 'register_transaction':
-            for fpr, values in trade_matrix.items():
-                value = values[i]
-                # register_transaction only allows you to spend money. You don't receive
-                # until the transaction is confirmed.
-                if value < 0:
-                    current_balance = self.balance_sheet.get(fpr, 0)
-                    # You can only print your own currency
-                    if fpr != self.fpr and current_balance + value < 0:
-                        raise Exception(
-                            f'Current balance of {fpr} is {current_balance}, so you cannot spend {-value}.')
-                    self.balance_sheet[fpr] = current_balance + value
+            # register_transaction only allows you to spend money. You don't receive
+            # until the transaction is confirmed. You can only print your own currency.
+            self.ledger.spend(column.debit_ids, column.debit_values,
+                              self.ledger.ids.get(self.fpr))
+            return column.debit_ids, column.debit_values, 1
         elif t == 'confirm_transaction':
-            for fpr, values in trade_matrix.items():
-                value = values[i]
-                # Spending already happened in register_transaction. Only need to receive here.
-                if value >= 0:
-                    current_balance = self.balance_sheet.get(fpr, 0)
-                    self.balance_sheet[fpr] = current_balance + value
+            # Spending already happened in register_transaction. Only need to receive here.
+            self.ledger.add(column.credit_ids, column.credit_values)
+            return column.credit_ids, column.credit_values, 1
         elif t == 'cancel_transaction':
-            for fpr, values in trade_matrix.items():
-                value = values[i]
-                # Undo the spending that happened in register_transaction
-                if value < 0:
-                    current_balance = self.balance_sheet.get(fpr, 0)
-                    self.balance_sheet[fpr] = current_balance - value
+            # Undo the spending that happened in register_transaction
+            self.ledger.subtract(column.debit_ids, column.debit_values)
+            return column.debit_ids, column.debit_values, -1
         elif t == 'annul_transaction':
-            for fpr, values in trade_matrix.items():
-                value = values[i]
-                # Undo the receiving that happened in confirm_transaction
-                if value >= 0:
-                    current_balance = self.balance_sheet.get(fpr, 0)
-                    self.balance_sheet[fpr] = current_balance - value
+            # Undo the receiving that happened in confirm_transaction
+            self.ledger.subtract(column.credit_ids, column.credit_values)
+            return column.credit_ids, column.credit_values, -1
         elif t == 'reinstate_transaction':
-            for fpr, values in trade_matrix.items():
-                value = values[i]
-                # Undo the effect of annul_transaction
-                if value >= 0:
-                    current_balance = self.balance_sheet.get(fpr, 0)
-                    self.balance_sheet[fpr] = current_balance + value
+            # Undo the effect of annul_transaction
+            self.ledger.add(column.credit_ids, column.credit_values)
+            return column.credit_ids, column.credit_values, 1
         else:
             raise Exception('unknown action: ' + t)
 
     def print_balance_sheet(self):
-        for fpr, value in self.balance_sheet.items():
+        for fpr, value in self.ledger.items():
             comment = 'self' if fpr == self.fpr else 'other'
             yield f'{fpr},{value},{comment}\n'
 
-def verify_chain(rootdir):
-    numblocks = check_blockchain_dir(rootdir)
+    # Write the balance sheet, sorted by fingerprint, in one of the formats of
+    # balance_output.py.
+    def write_balance_sheet(self, f, fmt):
+        write_balances(f, sorted(self.ledger.items()), fmt, self.fpr)
+
+# CashVerifier with the timers and counters of stats.py. It's a separate class
+# so that the plain CashVerifier doesn't pay anything for them. self.stats is
+# set by verify_chain.
+
+
+class InstrumentedCashVerifier(CashVerifier):
+    transient_attrs = CashVerifier.transient_attrs + ('stats',)
+
+    def verify_block(self, idx):
+        super().verify_block(idx)
+        self.stats.block_done(idx)
+
+    def verify_core(self, idx):
+        start_bytes = bytes_read()
+        start = time.perf_counter()
+        block = super().verify_core(idx)
+        self.stats.add_time('core_verify', start)
+        self.count_bytes_read('core_verify', start_bytes)
+        return block
+
+    def read_block(self, idx):
+        start_bytes = bytes_read()
+        start = time.perf_counter()
+        block = super().read_block(idx)
+        self.stats.add_time('read_block', start)
+        self.count_bytes_read('read_block', start_bytes)
+        return block
+
+    def count_bytes_read(self, phase, start_bytes):
+        if start_bytes is not None:
+            self.stats.count('bytes_read.' + phase,
+                             bytes_read(include_this_read=False) - start_bytes)
+
+    def touched_transactions(self, block):
+        start = time.perf_counter()
+        touched = super().touched_transactions(block)
+        self.stats.add_time('transaction_lookup', start)
+        for t, transaction_hash, transaction_status in touched:
+            self.stats.count('actions.' + t)
+        return touched
+
+    def run_block_processors(self, idx, block, touched):
+        start = time.perf_counter()
+        super().run_block_processors(idx, block, touched)
+        self.stats.add_time('block_processors', start)
+
+    def validate_transaction(self, transaction):
+        start = time.perf_counter()
+        view = super().validate_transaction(transaction)
+        self.stats.add_time('validate', start)
+        num_participants = len(transaction['participants'])
+        for contract in self.pyomcash_contracts(transaction):
+            self.stats.count('trade_matrix_cells_validated',
+                             num_participants * len(contract['trade_matrix']))
+        return view
+
+    def apply_trade_column(self, t, column):
+        start = time.perf_counter()
+        changes = super().apply_trade_column(t, column)
+        self.stats.add_time('balance_update', start)
+        self.stats.count('trade_matrix_cells_applied', len(changes[0]))
+        return changes
+
+# Verify the chain in rootdir. If checkpoint is True, resume from the newest
+# valid checkpoint and save a new one at the end, so that the next run only
+# needs to verify the blocks that were appended in the meantime.
+#
+# block_processors are added to the verifier before any blocks are verified.
+# If stats is a VerifierStats, the verifier records timers and counters in it.
+# If index is a BalanceIndex, the balance changes of every block are added to
+# it. If streaming is True, the verifier runs in streaming mode (see
+# CashVerifier.enable_streaming), with a limit of max_memory bytes if given.
+#
+# If numblocks is given, only blocks 0..numblocks-1 are verified, even if more
+# have been appended since. Callers that need to know which block the returned
+# verifier is at should count the blocks once and pass the count in, rather
+# than count them again afterwards.
+
+
+def verify_chain(rootdir, checkpoint=True, block_processors=(), index=None, stats=None,
+                 streaming=False, max_memory=None, numblocks=None):
+    if numblocks is None:
+        numblocks = check_blockchain_dir(rootdir)
     if numblocks == 0:
         raise Exception('no blocks found')
     gpg_ctx = init_local_gpg(rootdir.joinpath(gnupg_dirname))
-    v = CashVerifier(rootdir, gpg_ctx)
-    for idx in range(0, numblocks):
+    cls = CashVerifier if stats is None else InstrumentedCashVerifier
+    start = 0
+    if checkpoint:
+        checkpoint_start = time.perf_counter()
+        saved = load_checkpoint(rootdir, numblocks)
+        if stats is not None:
+            stats.add_time('checkpoint_load', checkpoint_start)
+    else:
+        saved = None
+    if saved is None:
+        v = cls(rootdir, gpg_ctx)
+    else:
+        idx, state = saved
+        v = cls.from_state(rootdir, gpg_ctx, state)
+        start = idx + 1
+    if index is not None:
+        index.check_chain(rootdir, numblocks)
+        if index.next_block() < start:
+            # The index is missing some of the blocks before the checkpoint.
+            v = cls(rootdir, gpg_ctx)
+            start = 0
+        v.block_deltas = []
+        v.add_block_processor(index.process_block)
+    if stats is not None:
+        v.stats = stats
+    if streaming:
+        v.enable_streaming(max_memory)
+    for f in block_processors:
+        v.add_block_processor(f)
+    for idx in range(start, numblocks):
         try:
             v.verify_block(idx)
         except Exception as e:
             print(f'Error in block {idx}:', e, file=sys.stderr)
             raise Exception(f'Blockchain verification failed in block {idx}')
+    if index is not None:
+        index.commit()
+    if v.view_store is not None:
+        v.view_store.commit()
+    if checkpoint and start < numblocks:
+        checkpoint_start = time.perf_counter()
+        save_checkpoint(v, numblocks - 1)
+        if stats is not None:
+            stats.add_time('checkpoint_save', checkpoint_start)
     return v
 
 
 if __name__ == "__main__":
-    v = verify_chain(pathlib.Path.cwd())
-    print(''.join(v.print_balance_sheet()))
+    parser = argparse.ArgumentParser(prog='verifier')
+    parser.add_argument('--full', action='store_true',
+                        help='ignore checkpoints and verify the whole chain')
+    parser.add_argument('--index', action='store_true',
+                        help='update the balance index (see pyomcash.balance_index)')
+    parser.add_argument('--stats', nargs='?', const='-', metavar='FILE',
+                        help='write timers and counters as JSON to FILE (default: stderr)')
+    parser.add_argument('--format', choices=formats,
+                        help='print the balances sorted by fingerprint, in this format')
+    parser.add_argument('--streaming', action='store_true',
+                        help='keep the validated transactions that drop out of the cache on '
+                        'disk, and drop the trade matrices of cancelled transactions')
+    parser.add_argument('--max-memory', type=int, metavar='MB',
+                        help='streaming mode, also shrinking the view cache while the process '
+                        'is above MB megabytes of RSS (not a hard limit)')
+    args = parser.parse_args()
+    max_memory = None if args.max_memory is None else args.max_memory * 1024 * 1024
+    rootdir = pathlib.Path.cwd()
+    index = open_balance_index(rootdir) if args.index else None
+    stats = VerifierStats() if args.stats is not None else None
+    v = verify_chain(rootdir, checkpoint=not args.full,
+                     index=index, stats=stats,
+                     streaming=args.streaming or max_memory is not None,
+                     max_memory=max_memory)
+    if args.format is None:
+        sys.stdout.writelines(v.print_balance_sheet())
+        print()
+    elif args.format == 'columnar':
+        sys.stdout.flush()
+        v.write_balance_sheet(sys.stdout.buffer, args.format)
+    else:
+        v.write_balance_sheet(sys.stdout, args.format)
+    if args.stats == '-':
+        stats.dump(sys.stderr)
+    elif args.stats is not None:
+        with open(args.stats, 'w') as f:
+            stats.dump(f)
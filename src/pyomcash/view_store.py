@@ -0,0 +1,84 @@
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import sqlite3
+from .cache import cache_dir
+from .ledger import CashView, TradeColumn
+
+# On-disk store for the CashViews that the streaming verifier has evicted from
+# its view cache (see CashVerifier.enable_streaming), so that they can be read
+# back instead of validating the transaction again. The views are stored with
+# fingerprints rather than ledger ids, and a view only depends on its
+# transaction, so the store can be ahead of the checkpoints without harm. It's
+# only a cache: a view that isn't in the store is validated again.
+
+store_filename = 'cash_views.sqlite'
+
+schema = '''
+CREATE TABLE IF NOT EXISTS cash_views (
+    transaction_hash TEXT PRIMARY KEY,
+    view TEXT NOT NULL
+);
+'''
+
+
+class CashViewStore:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(schema)
+
+    def put(self, transaction_hash, view, ledger):
+        fprs = ledger.fprs
+        contracts = [[sorted(authors),
+                      [fprs[i] for i in column.debit_ids], column.debit_values,
+                      [fprs[i] for i in column.credit_ids], column.credit_values]
+                     for authors, column in view.contracts]
+        self.db.execute('INSERT OR REPLACE INTO cash_views VALUES (?, ?)',
+                        (transaction_hash, json.dumps({'index': view.index, 'contracts': contracts})))
+
+    # The view of the transaction, with its currencies interned in ledger, or
+    # None if it isn't in the store.
+    def get(self, transaction_hash, ledger):
+        row = self.db.execute(
+            'SELECT view FROM cash_views WHERE transaction_hash = ?',
+            (transaction_hash,)).fetchone()
+        if row is None:
+            return None
+        view = json.loads(row[0])
+        contracts = []
+        for authors, debit_fprs, debit_values, credit_fprs, credit_values in view['contracts']:
+            column = TradeColumn(tuple(map(ledger.intern, debit_fprs)), tuple(debit_values),
+                                 tuple(map(ledger.intern, credit_fprs)), tuple(credit_values))
+            contracts.append((frozenset(authors), column))
+        return CashView(view['index'], tuple(contracts))
+
+    def count(self):
+        return self.db.execute('SELECT COUNT(*) FROM cash_views').fetchone()[0]
+
+    def discard(self, transaction_hash):
+        self.db.execute('DELETE FROM cash_views WHERE transaction_hash = ?',
+                        (transaction_hash,))
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def open_cash_view_store(rootdir):
+    return CashViewStore(cache_dir(rootdir).joinpath(store_filename))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+# balance_output.py only reads and writes files, so this test doesn't need
+# pyomcore or gpg.
+
+import io
+import pathlib
+import tempfile
+from pyomcash.balance_output import diff_balances, read_balances, write_balances
+
+
+def error_of(f, *args):
+    try:
+        f(*args)
+    except Exception as e:
+        return str(e)
+    return None
+
+
+fpr_a = 'A' * 40
+fpr_b = 'B' * 40
+fpr_c = 'C' * 40
+
+tmpdir = pathlib.Path(tempfile.mkdtemp())
+balances = [(fpr_a, -5), (fpr_b, 2**63 - 1), (fpr_c, -2**63)]
+
+
+def dump(name, balances, fmt, own_fpr=None):
+    path = tmpdir.joinpath(name)
+    with open(path, 'wb' if fmt == 'columnar' else 'w') as f:
+        write_balances(f, balances, fmt, own_fpr)
+    return path
+
+
+# Every format reads back as what was written
+for fmt in ('csv', 'jsonl', 'columnar'):
+    assert read_balances(dump('balances.' + fmt, balances, fmt, fpr_b)) == balances
+print('round trip')
+
+# The columnar format is written as the balances are generated, with the
+# counts in a trailer at the end
+path = dump('generated.columnar', iter(balances), 'columnar', fpr_b)
+assert read_balances(path) == balances
+data = path.read_bytes()
+assert len(data) == 8 + 3*28 + 8
+assert data[-8:] == (3).to_bytes(4, 'little') + (1).to_bytes(4, 'little')
+assert read_balances(dump('empty.columnar', [], 'columnar')) == []
+print('columnar')
+
+# A truncated columnar file or a bad own currency position is an error
+tmpdir.joinpath('truncated.columnar').write_bytes(data[:-1])
+assert 'should be' in error_of(read_balances, tmpdir.joinpath('truncated.columnar'))
+tmpdir.joinpath('bad_own.columnar').write_bytes(
+    data[:-4] + (3).to_bytes(4, 'little'))
+assert 'own currency' in error_of(read_balances, tmpdir.joinpath('bad_own.columnar'))
+
+# Fingerprints and balances that don't fit the columnar format
+out = io.BytesIO()
+assert 'hex digit' in error_of(write_balances, out, [('A' * 39, 1)], 'columnar')
+assert 'hex digit' in error_of(write_balances, out, [('X' * 40, 1)], 'columnar')
+assert 'int64' in error_of(write_balances, out, [(fpr_a, 2**63)], 'columnar')
+print('columnar errors')
+
+# Fingerprints read back in upper case whatever the format and the case they
+# were written in, so the same currency matches across formats
+lower = [(fpr.lower(), balance) for fpr, balance in balances]
+for fmt in ('csv', 'jsonl', 'columnar'):
+    assert read_balances(dump('lower.' + fmt, lower, fmt)) == balances
+old = read_balances(dump('old.csv', lower, 'csv'))
+new = read_balances(dump('new.columnar', balances, 'columnar'))
+assert list(diff_balances(old, new)) == []
+print('fingerprint case')
+
+# The diff lists only the currencies whose balances differ, with a missing
+# currency counting as 0
+old = [(fpr_a, 1), (fpr_b, 2)]
+new = [(fpr_b, 3), (fpr_c, 4)]
+assert list(diff_balances(old, new)) == [
+    (fpr_a, 1, 0), (fpr_b, 2, 3), (fpr_c, 0, 4)]
+assert list(diff_balances([(fpr_a, 0)], [])) == []
+assert list(diff_balances(old, old)) == []
+print('diff')
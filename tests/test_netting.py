@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+# netting.py doesn't touch the chains, so this test doesn't need pyomcore or
+# gpg, just made-up paths and fingerprints.
+
+import pathlib
+from pyomcash.netting import net_trades, split_by_proposer
+
+a, b, c, d = [pathlib.Path(f'/pyom/user{i}') for i in range(4)]
+fpr_a = 'A' * 40
+fpr_b = 'B' * 40
+fpr_c = 'C' * 40
+fpr_d = 'D' * 40
+
+# a and b pay each other the same amount back and forth
+trades = [
+    ([a, b], {fpr_a: [-3, 3]}),
+    ([b, a], {fpr_a: [-3, 3]}),
+]
+netted_trades, report = net_trades(trades)
+assert netted_trades == []
+assert report['original_trades'] == [
+    {'trade': 0, 'netted_trades': []}, {'trade': 1, 'netted_trades': []}]
+assert report['currencies'] == {fpr_a: {'gross': 6, 'net': 0}}
+assert sorted(report['dropped_participants']) == [a.as_posix(), b.as_posix()]
+print('cancel out')
+
+# A chain of payments in one currency nets to a single payment
+trades = [
+    ([a, b], {fpr_a: [-5, 5]}),
+    ([b, c], {fpr_a: [-5, 5]}),
+]
+netted_trades, report = net_trades(trades)
+assert netted_trades == [([a, c], {fpr_a: [-5, 5]})]
+assert report['dropped_participants'] == [b.as_posix()]
+assert report['currencies'][fpr_a] == {'gross': 10, 'net': 5}
+print('chain')
+
+# Two unrelated trades stay separate
+trades = [
+    ([a, b], {fpr_a: [-2, 2]}),
+    ([c, d], {fpr_c: [-4, 4]}),
+]
+netted_trades, report = net_trades(trades)
+assert netted_trades == trades
+assert [t['netted_trades'] for t in report['original_trades']] == [[0], [1]]
+print('independent')
+
+# Sharing participants with a netted trade isn't enough to have gone into it:
+# trades 1 and 2 cancel out, so they didn't go into any netted trade.
+trades = [
+    ([a, b], {fpr_a: [-2, 2]}),
+    ([a, b], {fpr_b: [-1, 1]}),
+    ([b, a], {fpr_b: [-1, 1]}),
+]
+netted_trades, report = net_trades(trades)
+assert netted_trades == [([a, b], {fpr_a: [-2, 2]})]
+assert [t['netted_trades'] for t in report['original_trades']] == [[0], [], []]
+print('reconcile')
+
+# One currency connects all the participants of two trades
+trades = [
+    ([a, b], {fpr_a: [-2, 2], fpr_b: [1, -1]}),
+    ([c, a], {fpr_a: [-1, 1], fpr_c: [-3, 3]}),
+]
+netted_trades, report = net_trades(trades)
+[(rootdirs, trade_matrix)] = netted_trades
+assert rootdirs == [a, b, c]
+assert trade_matrix == {fpr_a: [-1, 2, -1], fpr_b: [1, -1, 0], fpr_c: [3, 0, -3]}
+assert [t['netted_trades'] for t in report['original_trades']] == [[0], [0]]
+print('connected')
+
+# The netted trades are split by their column 1 participant
+netted_trades = [([a, b], {fpr_a: [-2, 2]}),
+                 ([c, d], {fpr_c: [-4, 4]}),
+                 ([a, d], {fpr_d: [1, -1]})]
+batches = split_by_proposer(netted_trades)
+assert list(batches) == [a, c]
+assert batches[a] == [netted_trades[0], netted_trades[2]]
+assert batches[c] == [netted_trades[1]]
+print('split_by_proposer')
+
+# A trade matrix whose rows don't sum to zero is rejected
+error = None
+try:
+    net_trades([([a, b], {fpr_a: [-2, 3]})])
+except Exception as e:
+    error = str(e)
+assert error is not None and error.startswith('trade 0:')
+print('invalid')
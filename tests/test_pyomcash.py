@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU General Public License
 # along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
 
+import os
 import sys
 import pathlib
 import time
@@ -30,6 +31,10 @@ from pyomcore.reinstate_transaction import reinstate_transaction
 import pyomcore.verifier
 from pyomcash.utils import create_trade
 import pyomcash.verifier
+import pyomcash.multichain
+import pyomcash.snapshot
+import pyomcash.simulate
+from pyomcash.checkpoint import clear_checkpoints
 
 tmpdir = pathlib.Path(sys.argv[1])
 pyomcore_url = sys.argv[2]
@@ -38,6 +43,9 @@ pyomcash_url = sys.argv[3]
 tmpdir.mkdir(parents=True, exist_ok=True)
 tmpdir = tmpdir.resolve()
 
+# Keep the verifier checkpoints out of the real cache directory
+os.environ['PYOMCASH_CACHE_DIR'] = tmpdir.joinpath('cache').as_posix()
+
 users = []
 gpg_dirs = []
 rootdirs = []
@@ -163,3 +171,44 @@ for rootdir in rootdirs:
     print('verify', rootdir.parent.name)
     v = pyomcash.verifier.verify_chain(rootdir)
     print(''.join(v.print_balance_sheet()))
+    # Resuming from the checkpoint must give the same result as a full replay
+    checkpoint_v = pyomcash.verifier.verify_chain(rootdir)
+    full_v = pyomcash.verifier.verify_chain(rootdir, checkpoint=False)
+    assert checkpoint_v.balance_sheet == full_v.balance_sheet
+    assert checkpoint_v.author_fprs == full_v.author_fprs
+    # With room for only one view in the cache, streaming mode writes the
+    # others to the view store, and the second run reads them back from there
+    max_cached_views = pyomcash.verifier.max_cached_views
+    pyomcash.verifier.max_cached_views = 1
+    for _ in range(2):
+        streaming_v = pyomcash.verifier.verify_chain(
+            rootdir, checkpoint=False, streaming=True)
+        assert streaming_v.view_store.count() > 0
+        assert streaming_v.balance_sheet == full_v.balance_sheet
+    pyomcash.verifier.max_cached_views = max_cached_views
+
+# Bootstrap user0's verifier from a signed snapshot
+snapshot_path = tmpdir.joinpath('snapshot.json')
+snapshot_gpg_ctx = gpg.Context(home_dir=gpg_dirs[0].as_posix())
+pyomcash.snapshot.export_snapshot(rootdirs[0], snapshot_path, snapshot_gpg_ctx)
+clear_checkpoints(rootdirs[0])
+pyomcash.snapshot.import_snapshot(
+    rootdirs[0], snapshot_path, snapshot_gpg_ctx, fprs[0])
+snapshot_v = pyomcash.verifier.verify_chain(rootdirs[0])
+full_v = pyomcash.verifier.verify_chain(rootdirs[0], checkpoint=False)
+assert snapshot_v.balance_sheet == full_v.balance_sheet
+print('snapshot')
+
+# Spending one more than user0 has of user1's currency would fail
+simulation = pyomcash.simulate.Simulation(snapshot_v)
+balance1 = snapshot_v.ledger.get(fprs[1])
+trade = (rootdirs[0:2], {fprs[1]: [-balance1 - 1, balance1 + 1]})
+[result] = simulation.simulate_trades(rootdirs[0], [trade])
+assert result['status'] == 'unaffordable'
+assert result['shortfalls'][0]['short_by'] == 1
+print('simulate')
+
+# Verify all the chains together and check that they agree about the trades
+result = pyomcash.multichain.verify_chains(rootdirs)
+assert pyomcash.multichain.is_consistent(result)
+print('verify_chains')
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+# trades.py only reads files, so this test doesn't need pyomcore or gpg. The
+# .npz part is skipped if NumPy isn't installed.
+
+import json
+import pathlib
+import tempfile
+from pyomcash.trades import TradeMatrix, read_trade_batch, read_trade_csv, read_trade_file
+
+
+def error_of(f, *args):
+    try:
+        f(*args)
+    except Exception as e:
+        return str(e)
+    return None
+
+
+fpr_a = 'A' * 40
+fpr_b = 'B' * 40
+fpr_c = 'C' * 40
+
+tmpdir = pathlib.Path(tempfile.mkdtemp())
+user0 = tmpdir.joinpath('user0/pyom').resolve()
+user1 = tmpdir.joinpath('user1/pyom').resolve()
+header = f',{user0},{user1}\n'
+
+# A good trade
+path = tmpdir.joinpath('good.csv')
+path.write_text(header + f'{fpr_a},-3,3\n{fpr_b}, 2, -2\n')
+rootdirs, trade_matrix = read_trade_file(path)
+assert rootdirs == [user0, user1]
+assert isinstance(trade_matrix, TradeMatrix)
+assert trade_matrix.to_dict() == {fpr_a: [-3, 3], fpr_b: [2, -2]}
+print('csv')
+
+# Every bad row is reported, with its line number, not just the first one
+path = tmpdir.joinpath('bad.csv')
+path.write_text(header +
+                f'{fpr_a},-3,3\n'
+                f'{fpr_b},1\n'
+                f'{fpr_a},-1,1\n'
+                f'{fpr_c},x,1\n'
+                f'{fpr_b},{2**63},{-2**63}\n'
+                f'{fpr_c},1,1\n')
+error = error_of(read_trade_csv, path)
+assert error.startswith('5 bad rows in trade matrix:'), error
+lines = error.splitlines()[1:]
+assert lines[0] == f'{path}:3: row is length 2 but expected 3: {[fpr_b, "1"]}'
+assert lines[1] == f'{path}:4: duplicate currency {fpr_a}'
+assert lines[2].startswith(f'{path}:5: bad value:')
+assert lines[3].startswith(f'{path}:6: value out of int64 range:')
+assert lines[4] == f'{path}:7: row sums to 2, not 0'
+print('csv errors')
+
+# The edges of the int64 range are fine
+path = tmpdir.joinpath('int64.csv')
+path.write_text(header + f'{fpr_a},{-2**63 + 1},{2**63 - 1}\n')
+rootdirs, trade_matrix = read_trade_file(path)
+assert trade_matrix.to_dict() == {fpr_a: [-2**63 + 1, 2**63 - 1]}
+print('int64')
+
+# A bad header is rejected before any rows are read
+path = tmpdir.joinpath('header.csv')
+path.write_text(f'x,{user0}\n{fpr_a},0\n')
+assert error_of(read_trade_csv, path) == 'first cell of first row should be empty'
+print('csv header')
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+if np is not None:
+    path = tmpdir.joinpath('good.npz')
+    np.savez(path, rootdirs=np.array([str(user0), str(user1)]),
+             fprs=np.array([fpr_a, fpr_b]),
+             values=np.array([[-3, 3], [2, -2]], dtype=np.int64))
+    rootdirs, trade_matrix = read_trade_file(path)
+    assert rootdirs == [user0, user1]
+    assert trade_matrix.to_dict() == {fpr_a: [-3, 3], fpr_b: [2, -2]}
+    # Row sums are exact, even when they overflow int64
+    path = tmpdir.joinpath('bad.npz')
+    np.savez(path, rootdirs=np.array([str(user0), str(user1)]),
+             fprs=np.array([fpr_a, fpr_a, fpr_b]),
+             values=np.array([[-3, 3], [1, -1], [2**62, 2**62]], dtype=np.int64))
+    error = error_of(read_trade_file, path)
+    assert error.startswith('2 bad rows in trade matrix:'), error
+    assert f'{path}:row 2: row sums to {2**63}, not 0' in error
+    assert f'{path}:row 1: duplicate currency {fpr_a}' in error
+    # The shape has to match the participants and currencies
+    path = tmpdir.joinpath('shape.npz')
+    np.savez(path, rootdirs=np.array([str(user0), str(user1)]),
+             fprs=np.array([fpr_a]), values=np.array([[-1, 0, 1]], dtype=np.int64))
+    assert 'values has shape (1, 3) but expected (1, 2)' in error_of(read_trade_file, path)
+    print('npz')
+
+# A JSON Lines batch, with a blank line
+path = tmpdir.joinpath('batch.jsonl')
+path.write_text(json.dumps({'rootdirs': [str(user0), str(user1)],
+                            'trade_matrix': {fpr_a: [-1, 1]}}) + '\n\n' +
+                json.dumps({'rootdirs': [str(user1), str(user0)],
+                            'trade_matrix': {fpr_b: [-2, 2]}}) + '\n')
+assert read_trade_batch(path) == [([user0, user1], {fpr_a: [-1, 1]}),
+                                  ([user1, user0], {fpr_b: [-2, 2]})]
+path.write_text(json.dumps({'rootdirs': [str(user0)]}) + '\n')
+assert error_of(read_trade_batch, path).startswith(f'{path}:1: bad trade:')
+path.write_text('{"rootdirs": \n')
+assert error_of(read_trade_batch, path).startswith(f'{path}:1: bad trade:')
+print('jsonl')
+
+# A directory batch is read in filename order, and other files are ignored
+batchdir = tmpdir.joinpath('batch')
+batchdir.mkdir()
+batchdir.joinpath('2.csv').write_text(header + f'{fpr_b},-2,2\n')
+batchdir.joinpath('1.csv').write_text(header + f'{fpr_a},-1,1\n')
+batchdir.joinpath('notes.txt').write_text('not a trade')
+trades = read_trade_batch(batchdir)
+assert [trade_matrix.to_dict() for rootdirs, trade_matrix in trades] == [
+    {fpr_a: [-1, 1]}, {fpr_b: [-2, 2]}]
+print('directory')
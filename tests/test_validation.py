@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# Copyright 2022 Todd Fratello
+# This file is part of pyomcash.
+#
+# pyomcash is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyomcash is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyomcash. If not, see <https://www.gnu.org/licenses/>.
+
+# validation.py and ledger.py are pure, so this test doesn't need pyomcore or
+# gpg. Every check runs both on a small matrix, which is always checked in
+# pure Python, and on a large one, which is checked with NumPy if it's
+# installed, and the results have to be the same.
+
+from pyomcash import validation
+from pyomcash.ledger import Ledger, TradeColumn
+from pyomcash.validation import check_trade_matrix
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def error_of(num_participants, trade_matrix):
+    try:
+        check_trade_matrix(num_participants, trade_matrix)
+    except Exception as e:
+        return str(e)
+    return None
+
+
+def fpr(k):
+    return f'{k:040X}'
+
+# A zero-sum matrix with n participants and enough rows to reach the NumPy
+# path, with bad_row (a list of values) as row 0.
+
+
+def large_matrix(n, bad_row=None):
+    trade_matrix = {fpr(k): [1 - n] + [1] * (n - 1)
+                    for k in range(validation.numpy_min_cells // n + 1)}
+    if bad_row is not None:
+        trade_matrix[fpr(0)] = bad_row
+    return trade_matrix
+
+
+def check_both(n, bad_row, expected):
+    small = error_of(n, {fpr(0): bad_row})
+    large = error_of(n, large_matrix(n, bad_row))
+    if expected is None:
+        assert small is None and large is None, (small, large)
+    else:
+        assert small == f'1 errors in trade matrix:\n{fpr(0)}: {expected}', small
+        assert large == small, large
+
+
+def run_checks():
+    check_both(3, [-2, 1, 1], None)
+    check_both(3, [-2**63, 2**63 - 1, 1], None)
+    check_both(3, [-2, 1, 2], 'non-zero sum: sum([-2, 1, 2]) == 1')
+    check_both(3, [-2, 1], 'row is length 2 but expected 3: [-2, 1]')
+    check_both(3, [-2.0, 1, 1], 'value is not an int: -2.0')
+    check_both(3, [-2, True, 1], 'value is not an int: True')
+    check_both(3, [2**63, -2**63, 0], f'value is out of int64 range: {2**63}')
+    if np is not None:
+        check_both(3, [np.int64(-2), 1, 1], 'value is not an int: -2')
+    # Row sums that overflow int64 are still exact
+    check_both(2, [2**62, 2**62], f'non-zero sum: sum([{2**62}, {2**62}]) == {2**63}')
+    # Every bad row is listed
+    error = error_of(2, {fpr(0): [1, 1], fpr(1): [0, 0], fpr(2): [1, 'x']})
+    assert error.startswith('2 errors in trade matrix:\n'), error
+
+
+run_checks()
+print('check_trade_matrix')
+if np is not None:
+    # The same again with NumPy turned off
+    validation._numpy = False
+    run_checks()
+    validation._numpy = None
+    print('check_trade_matrix without numpy')
+
+    values = np.array([[2**62, 2**62], [-2**63, 2**63 - 1], [5, -5],
+                       [2**63 - 1, 2**63 - 1]], dtype=np.int64)
+    assert validation.nonzero_rows(values).tolist() == [0, 1, 3]
+    print('nonzero_rows')
+
+# Only your own currency can go negative, and the columns of a transaction are
+# checked together
+ledger = Ledger()
+own, a, b = ledger.intern('0' * 40), ledger.intern('A' * 40), ledger.intern('B' * 40)
+ledger.add([a, b], [5, 1])
+assert ledger.shortfalls([own, a, b], [-100, -5, -2], own) == [(b, 1, -2)]
+column1 = TradeColumn((a,), (-3,), (), ())
+column2 = TradeColumn((a, b), (-3, -1), (), ())
+assert ledger.shortfalls(column1.debit_ids, column1.debit_values, own) == []
+assert ledger.shortfalls(column2.debit_ids, column2.debit_values, own) == []
+assert ledger.columns_shortfalls([column1, column2], own) == [(a, 5, -6)]
+error = None
+try:
+    ledger.spend([a, b], [-6, -2], own)
+except Exception as e:
+    error = str(e)
+assert error == (f'Current balance of {"A" * 40} is 5, so you cannot spend 6. '
+                 f'Current balance of {"B" * 40} is 1, so you cannot spend 2.'), error
+assert ledger.as_dict() == {'A' * 40: 5, 'B' * 40: 1}
+print('shortfalls')